@@ -1,13 +1,90 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from routes.users import router as users_router
 from routes.vehicles import router as vehicles_router
 from routes.bookings import router as bookings_router
 from routes.coins import router as coins_router
+from routes.quotes import router as quotes_router
 from routes.admin_metrics import admin_router
-from database import connect_db, disconnect_db, database
+from database import connect_db, disconnect_db, db_health, watch_db
+from passwords import passwords
+from events import outbox
+from pricing import pricing
+from pool import pool_settings
+from schema import ensure_schema
+from statements import statements
+from pagination import NEXT_CURSOR_HEADER
+from instrumentation import InstrumentationMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import time
 
-app = FastAPI()
+log = logging.getLogger(__name__)
+
+# how long startup waits for warm-up before serving anyway (/ready stays 503
+# until warm-up finishes in the background)
+STARTUP_TIMEOUT = float(os.environ.get("STARTUP_TIMEOUT", 30))
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.started_at = time.perf_counter()
+        self.startup_seconds = None
+        self.connections = 0
+
+
+readiness = Readiness()
+
+
+async def _warm_up():
+    """
+    Connect (retrying with a short backoff), make sure the schema exists,
+    open the pool's min_size connections at once,
+    load the pricing table and start the outbox worker, so the first
+    requests hit warm connections.
+    """
+    await connect_db(retries=None)
+    # only now: the watchdog reconnects on its own and must not race this one
+    app.state.db_watch = asyncio.create_task(watch_db())
+    await ensure_schema()
+    try:
+        readiness.connections = await statements.prewarm(max(1, pool_settings.min_size))
+    except Exception:
+        # not fatal: connections are opened on first use
+        log.exception("connection pre-warm failed")
+    try:
+        await pricing.warm_up()
+    except Exception:
+        # not fatal: the first quote builds the rate table
+        log.exception("pricing table load failed")
+    outbox.start()
+    readiness.ready = True
+    readiness.startup_seconds = round(time.perf_counter() - readiness.started_at, 3)
+    log.info("warm-up done in %.3fs (%d connections warmed)", readiness.startup_seconds, readiness.connections)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.db_watch = None
+    warm_up = asyncio.create_task(_warm_up())
+    try:
+        await asyncio.wait_for(asyncio.shield(warm_up), STARTUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning("warm-up still running after %ss; serving, /ready reports 503 until done", STARTUP_TIMEOUT)
+    yield
+    for task in (warm_up, app.state.db_watch):
+        if task is not None:
+            task.cancel()
+    await outbox.stop()
+    passwords.shutdown()
+    await disconnect_db()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,33 +92,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(users_router)
 app.include_router(vehicles_router)
 app.include_router(bookings_router)
 app.include_router(coins_router)
+app.include_router(quotes_router)
 app.include_router(admin_router)
 
-@app.on_event("startup")
-async def startup():
-    await connect_db()
-
-@app.on_event("shutdown")
-async def shutdown():
-    await disconnect_db()
-
 @app.middleware("http")
 async def ensure_db_connection(request: Request, call_next):
-    if not database.is_connected:
-        try:
-            await connect_db()
-        except Exception:
-            from fastapi.responses import JSONResponse
-            return JSONResponse({"detail": "Database unavailable"}, status_code=503)
+    # flag maintained by watch_db(); no per-request probing or reconnecting
+    if not db_health.ok and request.url.path not in ("/health", "/ready"):
+        return JSONResponse({"detail": "Database unavailable"}, status_code=503)
     return await call_next(request)
 
+# added last, so it is the outermost layer and times everything above
+app.add_middleware(InstrumentationMiddleware)
+
 @app.get("/health")
 async def health():
-    ok = database.is_connected
-    return {"ok": ok}
+    return {"ok": db_health.ok, "last_error": db_health.last_error, "failures": db_health.failures}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once warm-up is done and the database is reachable."""
+    body = {
+        "ready": readiness.ready and db_health.ok,
+        "startup_seconds": readiness.startup_seconds,
+        "connections_warmed": readiness.connections,
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
@@ -0,0 +1,187 @@
+"""
+Read-through cache of users' coin balances (which doubles as a
+user-existence cache: a cached balance means the user exists).
+
+Backends:
+  BALANCE_CACHE_BACKEND=local  (default) in-process LRU + TTL, per worker
+  BALANCE_CACHE_BACKEND=redis  shared by all workers; needs the optional
+                               `redis` package and BALANCE_CACHE_REDIS_URL
+  BALANCE_CACHE_BACKEND=none   no caching, every read goes to Postgres;
+                               serve.py's default when it runs several
+                               workers, since a per-worker cache would
+                               return the old balance after a spend that
+                               another worker handled
+
+Every write bumps a per-user version. A read-through load remembers the
+version it started from and only stores its result if no write happened in
+the meantime, so a load racing a spend can't put the old balance back. The
+write paths call written() after commit. With the local backend this holds
+within one worker only, which is why multi-worker deployments use redis
+or none.
+"""
+from typing import Optional
+import itertools
+import logging
+import os
+
+from cache import TTLCache
+from statements import statements
+
+log = logging.getLogger(__name__)
+
+BALANCE_CACHE_BACKEND = os.environ.get("BALANCE_CACHE_BACKEND", "local")
+BALANCE_CACHE_TTL = float(os.environ.get("BALANCE_CACHE_TTL", 30))
+BALANCE_CACHE_MAXSIZE = int(os.environ.get("BALANCE_CACHE_MAXSIZE", 100_000))
+BALANCE_CACHE_REDIS_URL = os.environ.get("BALANCE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+USER_BALANCE = statements.register(
+    "balance_cache.user_balance",
+    "SELECT coin_balance FROM public.users WHERE username = $1",
+)
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self):
+        self._values = TTLCache("balances", maxsize=BALANCE_CACHE_MAXSIZE, ttl=BALANCE_CACHE_TTL)
+        # username -> version of their last write. Versions come from one
+        # counter, so a value never repeats, and only have to outlive the
+        # loads in flight when the write happened, so they expire too.
+        self._versions = TTLCache("balance_versions", maxsize=BALANCE_CACHE_MAXSIZE, ttl=BALANCE_CACHE_TTL)
+        self._counter = itertools.count(1)
+
+    async def version(self, username: str) -> int:
+        return self._versions.get(username) or 0
+
+    async def get(self, username: str) -> Optional[int]:
+        return self._values.get(username)
+
+    async def set_if_version(self, username: str, expected: int, balance: int) -> bool:
+        if (self._versions.get(username) or 0) != expected:
+            return False
+        self._values.set(username, balance)
+        return True
+
+    async def write(self, username: str, balance: Optional[int]) -> None:
+        self._versions.set(username, next(self._counter))
+        if balance is None:
+            self._values.invalidate(username)
+        else:
+            self._values.set(username, balance)
+
+
+class NullBackend:
+    name = "none"
+
+    async def version(self, username: str) -> int:
+        return 0
+
+    async def get(self, username: str) -> Optional[int]:
+        return None
+
+    async def set_if_version(self, username: str, expected: int, balance: int) -> bool:
+        return True
+
+    async def write(self, username: str, balance: Optional[int]) -> None:
+        pass
+
+
+class RedisBackend:
+    name = "redis"
+
+    # KEYS: version key, value key; ARGV: expected version, balance, ttl ms
+    _CAS = """
+    if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then return 0 end
+    redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+    return 1
+    """
+    # versions outlive values by far, so a reset can't re-enable an old load
+    _VERSION_TTL_MS = 24 * 3600 * 1000
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # optional dependency
+        self._redis = redis.from_url(url)
+        self._cas = self._redis.register_script(self._CAS)
+        self._ttl_ms = int(BALANCE_CACHE_TTL * 1000)
+
+    @staticmethod
+    def _keys(username: str):
+        return f"bal:v:{username}", f"bal:{username}"
+
+    async def version(self, username: str) -> int:
+        return int(await self._redis.get(self._keys(username)[0]) or 0)
+
+    async def get(self, username: str) -> Optional[int]:
+        raw = await self._redis.get(self._keys(username)[1])
+        return int(raw) if raw is not None else None
+
+    async def set_if_version(self, username: str, expected: int, balance: int) -> bool:
+        return bool(await self._cas(keys=list(self._keys(username)), args=[expected, balance, self._ttl_ms]))
+
+    async def write(self, username: str, balance: Optional[int]) -> None:
+        vkey, key = self._keys(username)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incr(vkey)
+            pipe.pexpire(vkey, self._VERSION_TTL_MS)
+            if balance is None:
+                pipe.delete(key)
+            else:
+                pipe.set(key, balance, px=self._ttl_ms)
+            await pipe.execute()
+
+
+class BalanceCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stale_loads_dropped = 0
+
+    async def get_balance(self, username: str) -> Optional[int]:
+        """Balance of `username`, or None if the user doesn't exist (not cached)."""
+        cached = await self.backend.get(username)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        version = await self.backend.version(username)
+        balance = await statements.fetch_val(USER_BALANCE, username)
+        if balance is not None and not await self.backend.set_if_version(username, version, balance):
+            self.stale_loads_dropped += 1
+        return balance
+
+    async def written(self, username: str, balance: Optional[int]) -> None:
+        """Call after a committed balance change; balance=None just invalidates."""
+        try:
+            await self.backend.write(username, balance)
+        except Exception:
+            log.warning("balance cache write for %r failed", username, exc_info=True)
+
+    async def invalidate(self, username: str) -> None:
+        await self.written(username, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_loads_dropped": self.stale_loads_dropped,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _make_backend():
+    if BALANCE_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(BALANCE_CACHE_REDIS_URL)
+        except ImportError:
+            log.warning("BALANCE_CACHE_BACKEND=redis but the redis package is missing; not caching")
+            return NullBackend()
+    if BALANCE_CACHE_BACKEND == "none":
+        return NullBackend()
+    return LocalBackend()
+
+
+balance_cache = BalanceCache(_make_backend())
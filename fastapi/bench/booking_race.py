@@ -0,0 +1,95 @@
+"""
+Concurrency stress test for POST /bookings.
+
+Fires `--clients` simultaneous bookings, each by a different user, for the
+same vehicle and dates, for `--rounds` vehicles. Exactly one request per
+round may win (200); the rest must get 409. Afterwards the database is
+checked for overlapping bookings by different users. Exits non-zero on any
+violation.
+
+Run the API against the bench database (with or without the
+bookings_no_overlap constraint, or with BOOKING_ADVISORY_LOCKS=1) and use
+several workers so requests really race:
+
+    cd fastapi
+    python -m bench.booking_race --seed --base-url http://localhost:8000 --clients 50 --rounds 20
+
+tests/test_booking_race.py runs the same check in-process under pytest.
+"""
+from collections import Counter
+from datetime import date, timedelta
+import argparse
+import asyncio
+import sys
+
+import httpx
+
+from bench.fixtures import bench_database, seed
+
+OVERLAPPING_PAIRS = """
+    SELECT COUNT(*)
+    FROM public.bookings a
+    JOIN public.bookings b
+      ON a.vehicle_id = b.vehicle_id
+     AND a.id < b.id
+     AND a.username IS DISTINCT FROM b.username
+     AND daterange(a.start_date, a.end_date, '[]') && daterange(b.start_date, b.end_date, '[]')
+"""
+
+
+async def _round(client: httpx.AsyncClient, vehicle_id: int, clients: int, start: date) -> Counter:
+    end = start + timedelta(days=2)
+    quote = await client.get("/quote", params={
+        "vehicle_id": vehicle_id, "start_date": start.isoformat(), "end_date": end.isoformat(),
+    })
+    quote.raise_for_status()
+
+    async def book(i: int) -> int:
+        r = await client.post("/bookings", json={
+            "vehicle_id": vehicle_id,
+            "username": f"bench_user_{i}",
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "coins_used": quote.json()["coins"],
+            "quote_token": quote.json()["quote_token"],
+        })
+        return r.status_code
+
+    return Counter(await asyncio.gather(*(book(i) for i in range(clients))))
+
+
+async def main(args) -> int:
+    db = bench_database()
+    await db.connect()
+    try:
+        if args.seed:
+            await seed(db, users=args.clients, vehicles=args.rounds, bookings=0)
+
+        failures = 0
+        limits = httpx.Limits(max_connections=args.clients)
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+            start = date.today() + timedelta(days=30)
+            for r in range(args.rounds):
+                statuses = await _round(client, r + 1, args.clients, start)
+                ok = statuses.get(200, 0) == 1 and statuses.get(200, 0) + statuses.get(409, 0) == args.clients
+                failures += not ok
+                print(f"vehicle {r + 1:>4}: {dict(sorted(statuses.items()))}{'' if ok else '  <-- FAIL'}")
+
+        overlaps = await db.fetch_val(OVERLAPPING_PAIRS)
+        print(f"overlapping booking pairs in database: {overlaps}")
+        if failures or overlaps:
+            print(f"FAILED: {failures} bad rounds, {overlaps} overlapping pairs")
+            return 1
+        print("OK")
+        return 0
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--seed", action="store_true", help="wipe and reseed the bench tables first")
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--rounds", type=int, default=20)
+    sys.exit(asyncio.run(main(ap.parse_args())))
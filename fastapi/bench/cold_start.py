@@ -0,0 +1,105 @@
+"""
+Cold-start timing: how long from launching the API until it is ready and
+until the first booking goes through.
+
+Starts `python serve.py` (so the production worker count and warm-up are
+what gets measured), polls GET /ready, then quotes and POSTs a booking
+until one succeeds. Prints both times and exits non-zero when the first booking took
+longer than --target seconds. The API process is stopped afterwards.
+
+Point the API at the bench database (the environment is passed through):
+
+    cd fastapi
+    POSTGRES_DB=advcompro_bench WORKERS=4 PORT=8010 \\
+        python -m bench.cold_start --seed --vehicles 10000 --bookings 200000 --target 5
+"""
+from datetime import date, timedelta
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.fixtures import bench_database, seed
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _wait_for(client: httpx.AsyncClient, request, deadline: float, proc: subprocess.Popen):
+    """Repeat request() until it returns 200; None if the deadline passed or the API died."""
+    while time.perf_counter() < deadline and proc.poll() is None:
+        try:
+            r = await request()
+            if r.status_code == 200:
+                return r
+        except httpx.TransportError:
+            pass  # not listening yet
+        await asyncio.sleep(0.02)
+    return None
+
+
+async def main(args) -> int:
+    if args.seed:
+        db = bench_database()
+        await db.connect()
+        try:
+            await seed(db, users=args.users, vehicles=args.vehicles, bookings=args.bookings)
+        finally:
+            await db.disconnect()
+
+    env = {**os.environ, "PORT": str(args.port)}
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "serve.py"], cwd=HERE, env=env)
+    try:
+        deadline = started + args.timeout
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=5) as client:
+            r = await _wait_for(client, lambda: client.get("/ready"), deadline, proc)
+            if r is None:
+                print("API never became ready")
+                return 1
+            ready_s = time.perf_counter() - started
+
+            start = date.today() + timedelta(days=365 + int(time.time()) % 1000)
+            booking = {"vehicle_id": 1, "start_date": start.isoformat(), "end_date": start.isoformat()}
+            r = await _wait_for(client, lambda: client.get("/quote", params=booking), deadline, proc)
+            if r is None:
+                print("no quote for the booking")
+                return 1
+            booking.update(username="bench_user_0", coins_used=r.json()["coins"], quote_token=r.json()["quote_token"])
+            r = await _wait_for(client, lambda: client.post("/bookings", json=booking), deadline, proc)
+            if r is None:
+                print("no booking succeeded")
+                return 1
+            booked_s = time.perf_counter() - started
+            warm = (await client.get("/ready")).json()
+            print(f"ready after {ready_s:.3f}s (worker warm-up {warm['startup_seconds']}s, "
+                  f"{warm['connections_warmed']} connections warmed)")
+            print(f"first booking after {booked_s:.3f}s (target {args.target}s)")
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    if booked_s > args.target:
+        print("FAILED: slower than target")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8010)
+    ap.add_argument("--seed", action="store_true", help="wipe and reseed the bench tables first")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--vehicles", type=int, default=10_000)
+    ap.add_argument("--bookings", type=int, default=200_000)
+    ap.add_argument("--target", type=float, default=5.0, help="max seconds from launch to first booking")
+    ap.add_argument("--timeout", type=float, default=120.0, help="give up after this many seconds")
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,84 @@
+"""
+Event-loop latency during a login storm (no database needed).
+
+    cd fastapi
+    python -m bench.login_storm --logins 200 --concurrency 50
+
+A ticker task sleeps --tick ms in a loop and records how late it wakes up.
+The storm runs --logins password verifications, first inline on the event
+loop (what a plain hashlib call in a route does), then through
+passwords.verify() on the executor. The ticker's lag should stay flat in
+the second run while throughput is bounded by PASSWORD_WORKERS.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import passwords as pw
+
+
+def _pct(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+async def _ticker(tick: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(tick)
+        lags.append((time.perf_counter() - t0 - tick) * 1000)
+
+
+async def _storm(name: str, verify, stored: str, args):
+    lags: list = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(args.tick / 1000, lags, stop))
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with sem:
+            ok, _ = await verify("correct horse battery staple", stored)
+            assert ok
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await ticker
+    lags = lags or [0.0]
+    print(
+        f"{name:<9} logins/s={args.logins / elapsed:7.1f} "
+        f"loop lag p50={_pct(lags, 50):7.2f}ms p99={_pct(lags, 99):7.2f}ms "
+        f"max={max(lags):7.2f}ms mean={statistics.mean(lags):6.2f}ms ticks={len(lags)}"
+    )
+
+
+async def main(args):
+    hasher = pw.PasswordHasher(executor=args.executor, workers=args.workers)
+    stored = await hasher.hash("correct horse battery staple")
+    print(f"hash: {stored.split('$')[0]} params={pw._current_params()} workers={args.workers} ({args.executor})")
+
+    async def inline_verify(password, stored):
+        # same work as PasswordHasher.verify, but on the event loop thread
+        algorithm, params, salt, expected = pw._parse(stored)
+        fn = pw._scrypt if algorithm == "scrypt" else pw._pbkdf2
+        return fn(password.encode(), salt, *params) == expected, False
+
+    try:
+        if not args.skip_inline:
+            await _storm("inline", inline_verify, stored, args)
+        await _storm("executor", hasher.verify, stored, args)
+    finally:
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--tick", type=float, default=5.0, help="ticker interval in ms")
+    ap.add_argument("--executor", choices=["thread", "process"], default=pw.PASSWORD_EXECUTOR)
+    ap.add_argument("--workers", type=int, default=pw.PASSWORD_WORKERS)
+    ap.add_argument("--skip-inline", action="store_true")
+    asyncio.run(main(ap.parse_args()))
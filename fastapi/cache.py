@@ -0,0 +1,148 @@
+"""
+Small in-process caches: LRU eviction + per-entry TTL, with an optional
+stale-while-revalidate window.
+
+Every cache is created with a name and registered, so GET /admin/caches can
+report sizes and hit/miss counters for all of them.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+_registry: Dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """
+    `ttl` is how long an entry is fresh. With `stale_ttl` > 0 an expired entry
+    is kept that much longer and get_or_load(..., stale_while_revalidate=True)
+    serves it immediately while a single background task reloads it.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0, stale_ttl: float = 0.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (value, fresh_until, stale_until)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, float]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry[name] = self
+
+    # ---- Basic operations ----
+    def _lookup(self, key: Hashable) -> Tuple[Any, bool]:
+        """(value, is_fresh) or (_MISSING, False); drops fully expired entries."""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING, False
+        value, fresh_until, stale_until = entry
+        now = time.monotonic()
+        if now >= stale_until:
+            del self._data[key]
+            return _MISSING, False
+        self._data.move_to_end(key)
+        return value, now < fresh_until
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value, fresh = self._lookup(key)
+        if value is _MISSING or not fresh:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        fresh_until = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, fresh_until, fresh_until + self.stale_ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # ---- Read-through ----
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        # one load per key at a time; concurrent callers await the same future
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[key] = fut
+        try:
+            value = await loader()
+            self.set(key, value)
+            fut.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._loading.pop(key, None)
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            await self._load(key, loader)
+        except Exception:
+            log.warning("background refresh of %s[%r] failed", self.name, key, exc_info=True)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        stale_while_revalidate: bool = False,
+    ) -> Any:
+        value, fresh = self._lookup(key)
+        if value is not _MISSING:
+            if fresh:
+                self.hits += 1
+                return value
+            if stale_while_revalidate:
+                self.stale_hits += 1
+                if key not in self._loading:
+                    task = asyncio.create_task(self._refresh(key, loader))
+                    self._refreshing.add(task)
+                    task.add_done_callback(self._refreshing.discard)
+                return value
+        self.misses += 1
+        return await self._load(key, loader)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_stats() -> Dict[str, dict]:
+    return {name: c.stats() for name, c in sorted(_registry.items())}
@@ -1,35 +1,131 @@
-from databases import Database
+from pool import PooledDatabase, pool_settings
+from typing import Optional
 import asyncio
+import asyncpg
+import logging
+import os
+import time
 
-POSTGRES_USER = "temp"
-POSTGRES_PASSWORD = "temp"
-POSTGRES_DB = "advcompro"
-POSTGRES_HOST = "db"
+log = logging.getLogger(__name__)
 
-DATABASE_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}'
+POSTGRES_USER = os.environ.get("POSTGRES_USER", "temp")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD", "temp")
+POSTGRES_DB = os.environ.get("POSTGRES_DB", "advcompro")
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "db")
 
-database = Database(DATABASE_URL)
+DATABASE_URL = os.environ.get(
+    "DATABASE_URL",
+    f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}',
+)
 
-async def connect_db(retries: int = 20, delay: float = 0.5):
-    """Connect with retry/backoff so API survives DB restarts."""
+database = PooledDatabase(DATABASE_URL, **pool_settings.pool_options())
+
+async def connect_db(retries: Optional[int] = 20, delay: float = 0.1, max_delay: float = 1.0):
+    """
+    Connect with retry/backoff so API survives DB restarts; retries=None
+    keeps trying. Backoff starts small so a database that comes up a moment
+    after us costs milliseconds, not seconds.
+    """
     attempt = 0
     while True:
         try:
             await database.connect()
+            db_health.ok = True
             return
         except Exception:
             attempt += 1
-            if attempt >= retries:
+            if retries is not None and attempt >= retries:
                 raise
             await asyncio.sleep(delay)
             # small exponential backoff
-            delay = min(delay * 1.5, 5.0)
+            delay = min(delay * 1.5, max_delay)
 
 async def disconnect_db():
+    db_health.ok = False
     await database.disconnect()
     print("Database disconnected")
 
 
+# ---- Health flag ----
+class DbHealth:
+    """
+    Cheap flag read by the request middleware; kept current by watch_db()
+    so requests never probe or reconnect themselves.
+    """
+    def __init__(self):
+        self.ok = False
+        self.checked_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+
+db_health = DbHealth()
+
+DB_HEALTH_INTERVAL = float(os.environ.get("DB_HEALTH_INTERVAL", 5))
+DB_HEALTH_TIMEOUT = float(os.environ.get("DB_HEALTH_TIMEOUT", 5))
+# consecutive failed probes before requests get 503
+DB_HEALTH_FAILURES = int(os.environ.get("DB_HEALTH_FAILURES", 3))
+
+# errors that mean the server is gone, not just slow
+_CONNECTION_ERRORS = (
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+)
+
+def _probe_dsn() -> str:
+    # asyncpg wants the plain scheme, not the SQLAlchemy dialect spelling
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+async def _close_quietly(conn) -> None:
+    try:
+        await conn.close(timeout=1)
+    except Exception:
+        conn.terminate()
+
+async def watch_db(interval: float = DB_HEALTH_INTERVAL):
+    """
+    Background probe: SELECT 1 every `interval`s on a connection of its own,
+    so a busy pool (every connection checked out, queries waiting to
+    acquire) never reads as a dead database. The flag only drops after
+    DB_HEALTH_FAILURES probes in a row fail, and the pool is only torn down
+    and reconnected when the server is unreachable -- a slow probe is
+    counted, never acted on by itself.
+    """
+    probe = None
+    while True:
+        try:
+            if probe is None or probe.is_closed():
+                probe = await asyncpg.connect(_probe_dsn(), timeout=DB_HEALTH_TIMEOUT)
+            await probe.fetchval("SELECT 1", timeout=DB_HEALTH_TIMEOUT)
+            if not database.is_connected:
+                await connect_db(retries=1)
+            db_health.ok, db_health.last_error, db_health.failures = True, None, 0
+        except asyncio.CancelledError:
+            if probe is not None:
+                probe.terminate()
+            raise
+        except Exception as e:
+            db_health.failures += 1
+            db_health.last_error = str(e) or type(e).__name__
+            unreachable = isinstance(e, _CONNECTION_ERRORS)
+            if probe is not None and (unreachable or isinstance(e, asyncio.TimeoutError)):
+                # a timed-out query leaves the probe connection mid-statement
+                await _close_quietly(probe)
+                probe = None
+            if db_health.failures >= DB_HEALTH_FAILURES:
+                if db_health.ok:
+                    log.warning("database health check failed %d times: %s", db_health.failures, e)
+                db_health.ok = False
+                if unreachable and database.is_connected:
+                    try:
+                        await database.disconnect()
+                    except Exception:
+                        pass
+        db_health.checked_at = time.time()
+        await asyncio.sleep(interval)
+
+
 # Function to insert a new user into the users table
 async def insert_user(username: str, password_hash: str, email: str):
     query = """
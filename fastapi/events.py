@@ -0,0 +1,283 @@
+"""
+Domain events: a transactional outbox drained into an in-process bus.
+
+Booking and coin writes insert their events (BookingCreated, CoinsChanged)
+into public.event_outbox in the same statement/transaction as the write
+itself, so an event exists if and only if the write committed, and it
+survives restarts. The response goes out right after that commit.
+
+OutboxWorker drains the table in batches (FOR UPDATE SKIP LOCKED, so every
+worker process can run one):
+
+  1. projections run as set-based SQL over the claimed rows, in the same
+     transaction that deletes them, so they apply exactly once:
+     coin_ledger_daily (for /coins/summary) and the 'rentals' / 'spending'
+     counters (for /admin/metrics) -- both used to be triggers on the
+     request's INSERT;
+  2. after that transaction commits, the decoded events go to the EventBus.
+     Nothing waits on subscribers while rows are locked, and a subscriber
+     only ever sees projections that are already visible. Delivery is
+     at-most-once and to this process only (a crash between the commit and
+     the publish drops it), so subscribers are for in-process hooks such as
+     cache invalidation, never for state that must add up.
+
+What stays in the request on purpose: the ledger row is written with the
+balance change (it carries balance_after and is the audit trail, not a side
+effect), and in-process cache updates stay synchronous so a user reads
+their own write on the next request.
+
+The bus has a bounded queue: when subscribers fall behind, publish() waits,
+the worker stops claiming, and the backlog stays in the table instead of
+memory.
+"""
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Awaitable, Callable, ClassVar, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+
+from database import database
+from statements import statements
+
+log = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 500))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1.0))
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", 1000))
+EVENT_CONSUMERS = int(os.environ.get("EVENT_CONSUMERS", 4))
+
+
+# Outbox payloads; the SQL write paths build the same keys with jsonb.
+@dataclass(frozen=True)
+class BookingCreated:
+    topic: ClassVar[str] = "BookingCreated"
+    booking_id: int
+    vehicle_id: int
+    username: str
+    start_date: str
+    end_date: str
+    coins_used: int
+
+
+@dataclass(frozen=True)
+class CoinsChanged:
+    topic: ClassVar[str] = "CoinsChanged"
+    username: str
+    change_amount: int
+    reason: str
+    reference_type: Optional[str]
+    reference_id: Optional[str]
+    balance_after: Optional[int]
+
+
+EVENT_TYPES = {cls.topic: cls for cls in (BookingCreated, CoinsChanged)}
+
+
+def payload_json(event) -> str:
+    """Outbox payload of an event built in Python (the SQL paths use jsonb)."""
+    return json.dumps(asdict(event), separators=(",", ":"))
+
+
+def _decode(topic: str, payload: str):
+    cls = EVENT_TYPES.get(topic)
+    if cls is None:
+        return None
+    data = json.loads(payload)
+    return cls(**{f.name: data.get(f.name) for f in fields(cls)})
+
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class EventBus:
+    """Bounded queue + consumer tasks; subscribers are async callables per topic."""
+
+    def __init__(self, maxsize: int, consumers: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._consumers = consumers
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.delivered = 0
+        self.handler_errors = 0
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._consume()) for _ in range(self._consumers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def publish(self, event) -> None:
+        """Queue an event; waits while the queue is full."""
+        await self._queue.put(event)
+
+    async def _consume(self) -> None:
+        while True:
+            event = await self._queue.get()
+            try:
+                for handler in self._handlers.get(event.topic, ()):
+                    try:
+                        await handler(event)
+                    except Exception:
+                        # one broken subscriber must not hold back the others
+                        self.handler_errors += 1
+                        log.exception("event handler %r failed for %s", handler, event.topic)
+                self.delivered += 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "subscribers": {t: len(h) for t, h in self._handlers.items()},
+            "delivered": self.delivered,
+            "handler_errors": self.handler_errors,
+        }
+
+
+# ---- Outbox statements ----
+OUTBOX_CLAIM = statements.register(
+    "events.outbox.claim",
+    """
+    SELECT id, topic, payload::text AS payload
+    FROM public.event_outbox
+    ORDER BY id
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+    """,
+)
+# same folding as the old coin_ledger_rollup trigger; created_at of the
+# outbox row is the transaction's now(), like the ledger row's
+OUTBOX_LEDGER_ROLLUP = statements.register(
+    "events.outbox.ledger_rollup",
+    """
+    INSERT INTO public.coin_ledger_daily AS d (username, day, reason, credits, debits, entries)
+    SELECT payload->>'username', (created_at AT TIME ZONE 'UTC')::date, payload->>'reason',
+           SUM(GREATEST((payload->>'change_amount')::bigint, 0)),
+           SUM(GREATEST(-(payload->>'change_amount')::bigint, 0)),
+           COUNT(*)
+    FROM public.event_outbox
+    WHERE id = ANY($1::bigint[]) AND topic = 'CoinsChanged'
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (username, day, reason) DO UPDATE
+    SET credits = d.credits + EXCLUDED.credits,
+        debits  = d.debits  + EXCLUDED.debits,
+        entries = d.entries + EXCLUDED.entries
+    """,
+)
+OUTBOX_BOOKING_COUNTERS = statements.register(
+    "events.outbox.booking_counters",
+    """
+    SELECT public.bump_metric_counter('rentals', COUNT(*)),
+           public.bump_metric_counter('spending', COALESCE(SUM((payload->>'coins_used')::bigint), 0))
+    FROM public.event_outbox
+    WHERE id = ANY($1::bigint[]) AND topic = 'BookingCreated'
+    HAVING COUNT(*) > 0
+    """,
+)
+OUTBOX_DELETE = statements.register(
+    "events.outbox.delete",
+    "DELETE FROM public.event_outbox WHERE id = ANY($1::bigint[])",
+)
+OUTBOX_PENDING = statements.register(
+    "events.outbox.pending",
+    "SELECT COUNT(*) FROM public.event_outbox",
+)
+
+
+class OutboxWorker:
+    def __init__(self, bus: EventBus, batch_size: int, poll_interval: float):
+        self.bus = bus
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.events = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def notify(self) -> None:
+        """Called after a write committed outbox rows: drain now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self.bus.start()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.bus.stop()
+
+    async def drain_once(self) -> int:
+        """Claim, project and delete one batch, then publish it; returns its size."""
+        async with database.transaction():
+            rows = await statements.fetch_all(OUTBOX_CLAIM, self.batch_size)
+            if not rows:
+                return 0
+            ids = [r["id"] for r in rows]
+            await statements.execute(OUTBOX_LEDGER_ROLLUP, ids)
+            await statements.execute(OUTBOX_BOOKING_COUNTERS, ids)
+            await statements.execute(OUTBOX_DELETE, ids)
+        self.batches += 1
+        self.events += len(rows)
+        # committed: the rows are gone, so a publish failure can't redeliver
+        for r in rows:
+            event = _decode(r["topic"], r["payload"])
+            if event is not None:
+                await self.bus.publish(event)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                drained = await self.drain_once()
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. database down; the rows stay in the table for the next try
+                if self.last_error is None:
+                    log.warning("outbox drain failed: %s", e)
+                self.failures += 1
+                self.last_error = str(e)
+                drained = 0
+            if drained < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def stats(self) -> dict:
+        try:
+            pending = await statements.fetch_val(OUTBOX_PENDING)
+        except Exception:
+            pending = None
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "events": self.events,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "bus": self.bus.stats(),
+        }
+
+
+bus = EventBus(maxsize=EVENT_QUEUE_SIZE, consumers=EVENT_CONSUMERS)
+outbox = OutboxWorker(bus, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,232 @@
+"""
+Request and query instrumentation, exposed in Prometheus text format.
+
+InstrumentationMiddleware records, per (method, route template), a latency
+histogram and responses by status code, plus in-flight requests per method.
+Every database query -- `databases` calls through the pool backend
+(pool.py) and prepared statements (statements.py) -- is timed into a
+histogram per (route, query), where the query label is the statement name
+or the start of the SQL text. Queries slower than DB_SLOW_QUERY_MS are
+logged with their route.
+
+GET /admin/prom renders everything; GET /admin/requests gives the same
+request data as JSON with p50/p95/p99 estimated from the histogram buckets.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+DB_SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", 200))
+
+# upper bounds in seconds (Prometheus "le"), +Inf implied
+BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# ASGI scope of the request being served; the router stores the matched
+# route in it, so the label is resolved when a query actually runs
+_current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate by linear interpolation inside the bucket holding rank q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.50) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str], Histogram] = {}
+        self.statuses: Dict[Tuple[str, str, int], int] = {}
+        # per method: the route is only known once the router has matched
+        self.in_flight: Dict[str, int] = {}
+        self.queries: Dict[Tuple[str, str], Histogram] = {}
+        self.query_errors: Dict[Tuple[str, str], int] = {}
+        self.slow_queries = 0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route)
+        hist = self.requests.get(key)
+        if hist is None:
+            hist = self.requests[key] = Histogram()
+        hist.observe(seconds)
+        skey = (method, route, status)
+        self.statuses[skey] = self.statuses.get(skey, 0) + 1
+
+    def observe_query(self, query: str, seconds: float, ok: bool) -> None:
+        route = current_route()
+        key = (route, query)
+        hist = self.queries.get(key)
+        if hist is None:
+            hist = self.queries[key] = Histogram()
+        hist.observe(seconds)
+        if not ok:
+            self.query_errors[key] = self.query_errors.get(key, 0) + 1
+        if seconds * 1000 >= DB_SLOW_QUERY_MS:
+            self.slow_queries += 1
+            log.warning("slow query (%.1f ms) in %s: %s", seconds * 1000, route, query)
+
+    def request_summary(self) -> dict:
+        routes = {}
+        for (method, route), hist in sorted(self.requests.items()):
+            statuses = {
+                str(s): n for (m, r, s), n in self.statuses.items() if m == method and r == route
+            }
+            routes[f"{method} {route}"] = {**hist.summary(), "statuses": statuses}
+        return {"in_flight": dict(self.in_flight), "routes": routes}
+
+
+metrics = Metrics()
+
+
+def _route_of(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+def current_route() -> str:
+    scope = _current_scope.get()
+    return _route_of(scope) if scope is not None else "<background>"
+
+
+_WS = re.compile(r"\s+")
+_labels: Dict[str, str] = {}
+
+
+def query_label(sql: str) -> str:
+    """Whitespace-collapsed start of the SQL text, memoised (bounded label set)."""
+    label = _labels.get(sql)
+    if label is None:
+        label = _WS.sub(" ", sql).strip()[:80]
+        if len(_labels) < 10_000:
+            _labels[sql] = label
+    return label
+
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware overhead, works for streaming)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+        token = _current_scope.set(scope)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.in_flight[method] = metrics.in_flight.get(method, 0) + 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight[method] -= 1
+            _current_scope.reset(token)
+            metrics.observe_request(method, _route_of(scope), status, time.perf_counter() - started)
+
+
+# ---- Prometheus text format ----
+def prom_series(name: str, **labels) -> str:
+    return name + (_labels_str(labels) if labels else "")
+
+
+def _esc(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_str(labels: Dict[str, object]) -> str:
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, series: Iterable[Tuple[Dict[str, object], Histogram]]) -> List[str]:
+    lines = [f"# TYPE {name} histogram"]
+    for labels, hist in series:
+        cumulative = 0
+        for bound, n in zip(list(BUCKETS) + ["+Inf"], hist.counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels_str({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels_str(labels)} {hist.sum}")
+        lines.append(f"{name}_count{_labels_str(labels)} {hist.count}")
+    return lines
+
+
+def render_prometheus(gauges: Optional[Dict[str, float]] = None, counters: Optional[Dict[str, float]] = None) -> str:
+    """
+    Request/query metrics plus extra gauges and counters, given as
+    {'name{label="x"}': value} (see prom_series()).
+    """
+    lines = _histogram_lines(
+        "http_request_duration_seconds",
+        (({"method": m, "route": r}, h) for (m, r), h in sorted(metrics.requests.items())),
+    )
+    lines.append("# TYPE http_requests_total counter")
+    for (m, r, s), n in sorted(metrics.statuses.items()):
+        lines.append(f"http_requests_total{_labels_str({'method': m, 'route': r, 'status': s})} {n}")
+    lines.append("# TYPE http_requests_in_flight gauge")
+    for m, n in sorted(metrics.in_flight.items()):
+        lines.append(f"http_requests_in_flight{_labels_str({'method': m})} {n}")
+
+    lines += _histogram_lines(
+        "db_query_duration_seconds",
+        (({"route": r, "query": q}, h) for (r, q), h in sorted(metrics.queries.items())),
+    )
+    lines.append("# TYPE db_query_errors_total counter")
+    for (r, q), n in sorted(metrics.query_errors.items()):
+        lines.append(f"db_query_errors_total{_labels_str({'route': r, 'query': q})} {n}")
+    lines.append("# TYPE db_slow_queries_total counter")
+    lines.append(f"db_slow_queries_total {metrics.slow_queries}")
+
+    for kind, values in (("gauge", gauges or {}), ("counter", counters or {})):
+        typed = set()
+        for name, value in sorted(values.items()):
+            base = name.split("{", 1)[0]
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} {kind}")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
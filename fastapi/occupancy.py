@@ -0,0 +1,168 @@
+"""
+Free/busy calendars and per-day fleet availability, computed in SQL.
+
+Both answers come from one statement each: generate_series produces the
+days of the window, bookings overlapping the window are expanded to the
+days they cover, and consecutive days with the same status are folded into
+intervals (gaps-and-islands; Postgres 13 has no range_agg).
+
+Results are cached per window. Booking writes call bookings_changed(), which
+drops the affected vehicles' calendars and every fleet window; vehicle
+writes call fleet_changed(). Like the other caches this is per worker, so
+changes made through another worker show up after the TTL.
+"""
+from datetime import date
+from typing import Dict, Iterable, Optional
+import os
+
+from cache import TTLCache
+from statements import statements
+
+OCCUPANCY_CACHE_TTL = float(os.environ.get("OCCUPANCY_CACHE_TTL", 30))
+
+# $1 vehicle, $2..$3 window. No rows when the vehicle doesn't exist.
+CALENDAR = statements.register(
+    "occupancy.calendar",
+    """
+    WITH v AS (
+      SELECT rent_start_date::date AS rs, rent_end_date::date AS re
+      FROM public.vehicles
+      WHERE id = $1
+    ),
+    booked AS (
+      SELECT DISTINCT g.day::date AS day
+      FROM public.bookings b,
+           generate_series(GREATEST(b.start_date, $2::date), LEAST(b.end_date, $3::date),
+                           interval '1 day') AS g(day)
+      WHERE b.vehicle_id = $1
+        AND daterange(b.start_date, b.end_date, '[]') && daterange($2::date, $3::date, '[]')
+    ),
+    days AS (
+      SELECT d.day::date AS day,
+             CASE WHEN (v.rs IS NOT NULL AND d.day < v.rs) OR (v.re IS NOT NULL AND d.day > v.re)
+                    THEN 'unavailable'
+                  WHEN booked.day IS NOT NULL THEN 'booked'
+                  ELSE 'free' END AS status
+      FROM v
+      CROSS JOIN generate_series($2::date, $3::date, interval '1 day') AS d(day)
+      LEFT JOIN booked ON booked.day = d.day::date
+    ),
+    islands AS (
+      SELECT day, status,
+             day - (row_number() OVER (PARTITION BY status ORDER BY day))::int AS grp
+      FROM days
+    )
+    SELECT status, MIN(day) AS start_date, MAX(day) AS end_date, COUNT(*) AS days
+    FROM islands
+    GROUP BY status, grp
+    ORDER BY start_date
+    """,
+)
+
+# $1..$2 window, $3 type_of_car or NULL. Offered counts come from +1/-1
+# events at each vehicle's (clipped) rent window edges and a running sum,
+# so the cost is O(fleet + days) rather than fleet x days.
+FLEET_AVAILABILITY = statements.register(
+    "occupancy.fleet",
+    """
+    WITH fleet AS (
+      SELECT id,
+             GREATEST(COALESCE(rent_start_date::date, $1::date), $1::date) AS rs,
+             LEAST(COALESCE(rent_end_date::date, $2::date), $2::date)      AS re
+      FROM public.vehicles
+      WHERE ($3::text IS NULL OR type_of_car = $3::text)
+    ),
+    offered_events AS (
+      SELECT day, SUM(delta) AS delta
+      FROM (
+        SELECT rs AS day, 1 AS delta FROM fleet WHERE rs <= re
+        UNION ALL
+        SELECT re + 1, -1 FROM fleet WHERE rs <= re
+      ) e
+      GROUP BY day
+    ),
+    booked AS (
+      SELECT g.day::date AS day, COUNT(DISTINCT b.vehicle_id) AS n
+      FROM public.bookings b
+      JOIN fleet f ON f.id = b.vehicle_id,
+           generate_series(GREATEST(b.start_date, f.rs), LEAST(b.end_date, f.re),
+                           interval '1 day') AS g(day)
+      WHERE daterange(b.start_date, b.end_date, '[]') && daterange($1::date, $2::date, '[]')
+      GROUP BY 1
+    ),
+    days AS (
+      SELECT d.day::date AS day,
+             SUM(COALESCE(e.delta, 0)) OVER (ORDER BY d.day) AS offered
+      FROM generate_series($1::date, $2::date, interval '1 day') AS d(day)
+      LEFT JOIN offered_events e ON e.day = d.day::date
+    )
+    SELECT days.day, days.offered::int AS offered,
+           COALESCE(booked.n, 0)::int AS booked,
+           (days.offered - COALESCE(booked.n, 0))::int AS free
+    FROM days
+    LEFT JOIN booked ON booked.day = days.day
+    ORDER BY days.day
+    """,
+)
+
+_calendars = TTLCache("vehicle_calendar", maxsize=4096, ttl=OCCUPANCY_CACHE_TTL)
+_fleet = TTLCache("fleet_availability", maxsize=256, ttl=OCCUPANCY_CACHE_TTL)
+# bumped per vehicle on booking writes; part of the calendar cache key, so
+# old windows of that vehicle simply stop being looked up
+_calendar_generation: Dict[int, int] = {}
+
+
+async def vehicle_calendar(vehicle_id: int, start: date, end: date) -> Optional[dict]:
+    """Free/booked/unavailable intervals of one vehicle, or None if it doesn't exist."""
+    async def load():
+        rows = await statements.fetch_all(CALENDAR, vehicle_id, start, end)
+        if not rows:
+            return None
+        intervals = [
+            {"status": r["status"], "start_date": r["start_date"].isoformat(),
+             "end_date": r["end_date"].isoformat(), "days": r["days"]}
+            for r in rows
+        ]
+        return {
+            "vehicle_id": vehicle_id,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "free_days": sum(i["days"] for i in intervals if i["status"] == "free"),
+            "intervals": intervals,
+        }
+
+    key = (vehicle_id, _calendar_generation.get(vehicle_id, 0), start, end)
+    return await _calendars.get_or_load(key, load)
+
+
+async def fleet_availability(start: date, end: date, type_of_car: Optional[str]) -> dict:
+    async def load():
+        rows = await statements.fetch_all(FLEET_AVAILABILITY, start, end, type_of_car)
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "type_of_car": type_of_car,
+            "days": [
+                {"date": r["day"].isoformat(), "offered": r["offered"],
+                 "booked": r["booked"], "free": r["free"]}
+                for r in rows
+            ],
+        }
+
+    return await _fleet.get_or_load((start, end, type_of_car), load)
+
+
+def bookings_changed(vehicle_ids: Iterable[int]) -> None:
+    for vid in vehicle_ids:
+        _calendar_generation[vid] = _calendar_generation.get(vid, 0) + 1
+    _fleet.clear()
+
+
+def fleet_changed() -> None:
+    _fleet.clear()
+
+
+def clear() -> None:
+    """Drop everything, e.g. after bookings were edited outside the app."""
+    _calendars.clear()
+    _fleet.clear()
@@ -0,0 +1,60 @@
+"""
+Keyset (cursor) pagination and NDJSON streaming helpers.
+
+A cursor is the ORDER BY key of the last row of a page, JSON-encoded and
+base64url'd so clients treat it as opaque. The next-page cursor travels in
+the X-Next-Cursor response header, which keeps the JSON bodies unchanged.
+"""
+from typing import Any, AsyncIterator, Callable, List, Mapping, Optional
+import base64
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from record_json import dumps_line
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def is_cursor_int(value: Any) -> bool:
+    """JSON integers only: not floats, and not booleans (which are ints in Python)."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def split_page(rows: List[Any], limit: int, key: Callable[[Any], List[Any]]) -> Optional[str]:
+    """
+    `rows` was fetched with LIMIT limit + 1. Drops the extra row (in place)
+    and returns the cursor for the next page, or None on the last page.
+    """
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor(key(rows[-1]))
+
+
+async def _ndjson_lines(rows: AsyncIterator[Mapping]) -> AsyncIterator[bytes]:
+    async for r in rows:
+        yield dumps_line(r)
+
+
+def ndjson_response(rows: AsyncIterator[Mapping]) -> StreamingResponse:
+    """Stream rows (e.g. from database.iterate, a server-side cursor) as NDJSON."""
+    return StreamingResponse(_ndjson_lines(rows), media_type=NDJSON_MEDIA_TYPE)
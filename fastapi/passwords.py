@@ -0,0 +1,137 @@
+"""
+Password hashing off the event loop.
+
+Hashes are stored as self-describing strings so the cost can be raised
+later without invalidating existing rows:
+
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    scrypt$<n>$<r>$<p>$<salt>$<hash>             (salt/hash: base64, no padding)
+
+Anything else in users.password is a legacy plaintext value; it still
+verifies (constant-time) and verify_password() reports it as needing a
+rehash, so login upgrades it in place.
+
+The KDF runs on a bounded executor, configured from the environment:
+
+    PASSWORD_HASHER            pbkdf2_sha256 (default) | scrypt
+    PASSWORD_PBKDF2_ITERATIONS (default 600000)
+    PASSWORD_SCRYPT_N / _R / _P (default 16384 / 8 / 1)
+    PASSWORD_EXECUTOR          thread (default) | process
+    PASSWORD_WORKERS           (default: CPU count, capped at 4)
+
+hashlib releases the GIL while deriving, so threads give real parallelism
+without pickling overhead; "process" is there for interpreters where that
+doesn't hold.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2_sha256")
+PBKDF2_ITERATIONS = int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", 600_000))
+SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("PASSWORD_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("PASSWORD_SCRYPT_P", 1))
+PASSWORD_EXECUTOR = os.environ.get("PASSWORD_EXECUTOR", "thread")
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", min(4, os.cpu_count() or 1)))
+
+_SALT_BYTES = 16
+_HASH_BYTES = 32
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+# ---- KDFs (top-level so a process pool can pickle them) ----
+def _pbkdf2(password: bytes, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password, salt, iterations, _HASH_BYTES)
+
+def _scrypt(password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password, salt=salt, n=n, r=r, p=p,
+        maxmem=128 * n * r * p + 1024 * 1024, dklen=_HASH_BYTES,
+    )
+
+
+def _parse(stored: str) -> Optional[Tuple[str, tuple, bytes, bytes]]:
+    """(algorithm, params, salt, hash) or None for a legacy plaintext value."""
+    parts = stored.split("$")
+    try:
+        if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            return parts[0], (int(parts[1]),), _unb64(parts[2]), _unb64(parts[3])
+        if parts[0] == "scrypt" and len(parts) == 6:
+            return parts[0], tuple(int(x) for x in parts[1:4]), _unb64(parts[4]), _unb64(parts[5])
+    except ValueError:
+        pass
+    return None
+
+
+def _current_params() -> tuple:
+    if PASSWORD_HASHER == "scrypt":
+        return (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return (PBKDF2_ITERATIONS,)
+
+
+class PasswordHasher:
+    def __init__(self, executor: str = PASSWORD_EXECUTOR, workers: int = PASSWORD_WORKERS):
+        self.executor_kind = executor
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+        # bounds queued work, so a login storm waits here instead of piling
+        # up an unbounded executor queue
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+            self._slots = asyncio.Semaphore(self.workers * 4)
+        return self._executor
+
+    async def _derive(self, algorithm: str, params: tuple, password: str, salt: bytes) -> bytes:
+        executor = self._ensure_executor()
+        fn = _scrypt if algorithm == "scrypt" else _pbkdf2
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, fn, password.encode(), salt, *params
+            )
+
+    async def hash(self, password: str) -> str:
+        algorithm, params = PASSWORD_HASHER, _current_params()
+        salt = secrets.token_bytes(_SALT_BYTES)
+        digest = await self._derive(algorithm, params, password, salt)
+        return "$".join([algorithm, *map(str, params), _b64(salt), _b64(digest)])
+
+    async def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+        """(matches, needs_rehash). needs_rehash is only meaningful on a match."""
+        if stored is None:
+            return False, False
+        parsed = _parse(stored)
+        if parsed is None:
+            # legacy plaintext row
+            return hmac.compare_digest(password.encode(), stored.encode()), True
+        algorithm, params, salt, expected = parsed
+        digest = await self._derive(algorithm, params, password, salt)
+        ok = hmac.compare_digest(digest, expected)
+        return ok, (algorithm, params) != (PASSWORD_HASHER, _current_params())
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,180 @@
+"""
+Tunable, instrumented asyncpg pool behind the `databases` wrapper.
+
+Pool sizing, statement cache and timeouts come from the environment:
+
+    DB_POOL_MIN_SIZE                     (default 2)
+    DB_POOL_MAX_SIZE                     (default 10)
+    DB_STATEMENT_CACHE_SIZE              (default 100, 0 disables)
+    DB_COMMAND_TIMEOUT                   seconds, (default 30, 0 = none)
+    DB_MAX_INACTIVE_CONNECTION_LIFETIME  seconds, (default 300)
+    DB_ACQUIRE_TIMEOUT                   seconds, (default 10, 0 = wait forever)
+
+Every acquire goes through InstrumentedPostgresConnection so the time spent
+waiting for a free connection is recorded in `pool_stats`, and every query
+it runs is timed into the per-route query histograms (instrumentation.py).
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Any, AsyncGenerator, List, Optional
+import os
+import time
+
+from databases import Database
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+from sqlalchemy.sql import ClauseElement
+
+from instrumentation import metrics, query_label
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+@dataclass
+class PoolSettings:
+    min_size: int = field(default_factory=lambda: _env_int("DB_POOL_MIN_SIZE", 2))
+    max_size: int = field(default_factory=lambda: _env_int("DB_POOL_MAX_SIZE", 10))
+    statement_cache_size: int = field(default_factory=lambda: _env_int("DB_STATEMENT_CACHE_SIZE", 100))
+    command_timeout: float = field(default_factory=lambda: _env_float("DB_COMMAND_TIMEOUT", 30))
+    max_inactive_connection_lifetime: float = field(
+        default_factory=lambda: _env_float("DB_MAX_INACTIVE_CONNECTION_LIFETIME", 300)
+    )
+    acquire_timeout: float = field(default_factory=lambda: _env_float("DB_ACQUIRE_TIMEOUT", 10))
+
+    def pool_options(self) -> dict:
+        """kwargs passed through `databases` to asyncpg.create_pool."""
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "statement_cache_size": self.statement_cache_size,
+            "command_timeout": self.command_timeout or None,
+            "max_inactive_connection_lifetime": self.max_inactive_connection_lifetime,
+        }
+
+
+pool_settings = PoolSettings()
+
+
+class PoolStats:
+    def __init__(self):
+        self.acquires = 0
+        self.acquire_errors = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, ok: bool) -> None:
+        if ok:
+            self.acquires += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+        else:
+            self.acquire_errors += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "acquires": self.acquires,
+            "acquire_errors": self.acquire_errors,
+            "waiting": self.waiting,
+            "wait_avg_ms": round(self.wait_total / self.acquires * 1000, 3) if self.acquires else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "wait_total_s": round(self.wait_total, 3),
+        }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPostgresConnection(PostgresConnection):
+    async def acquire(self) -> None:
+        assert self._connection is None, "Connection is already acquired"
+        assert self._database._pool is not None, "DatabaseBackend is not running"
+        pool_stats.waiting += 1
+        started = time.perf_counter()
+        ok = False
+        try:
+            self._connection = await self._database._pool.acquire(
+                timeout=pool_settings.acquire_timeout or None
+            )
+            ok = True
+        finally:
+            pool_stats.waiting -= 1
+            pool_stats.record(time.perf_counter() - started, ok)
+
+    @staticmethod
+    def _label(query: ClauseElement) -> str:
+        # `databases` wraps raw SQL strings in TextClause; builder queries get their type
+        sql = getattr(query, "text", None)
+        return query_label(sql) if sql is not None else type(query).__name__
+
+    async def _timed(self, label: str, call) -> Any:
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await call
+            ok = True
+            return result
+        finally:
+            metrics.observe_query(label, time.perf_counter() - started, ok)
+
+    async def fetch_all(self, query: ClauseElement) -> List[Any]:
+        return await self._timed(self._label(query), super().fetch_all(query))
+
+    async def fetch_one(self, query: ClauseElement) -> Optional[Any]:
+        return await self._timed(self._label(query), super().fetch_one(query))
+
+    async def execute(self, query: ClauseElement) -> Any:
+        return await self._timed(self._label(query), super().execute(query))
+
+    async def execute_many(self, queries: List[ClauseElement]) -> None:
+        label = self._label(queries[0]) if queries else "execute_many"
+        return await self._timed(label, super().execute_many(queries))
+
+    async def iterate(self, query: ClauseElement) -> AsyncGenerator[Any, None]:
+        # timed from first to last row, i.e. including the consumer's pace
+        started = time.perf_counter()
+        ok = False
+        try:
+            async for row in super().iterate(query):
+                yield row
+            ok = True
+        finally:
+            metrics.observe_query(self._label(query), time.perf_counter() - started, ok)
+
+
+class InstrumentedPostgresBackend(PostgresBackend):
+    def connection(self) -> InstrumentedPostgresConnection:
+        return InstrumentedPostgresConnection(self, self._dialect)
+
+
+class PooledDatabase(Database):
+    """`databases.Database` whose Postgres backend reports acquire wait times."""
+    SUPPORTED_BACKENDS = {
+        **Database.SUPPORTED_BACKENDS,
+        "postgresql": "pool:InstrumentedPostgresBackend",
+        "postgresql+asyncpg": "pool:InstrumentedPostgresBackend",
+        "postgres": "pool:InstrumentedPostgresBackend",
+    }
+
+
+def raw_pool(db: Database):
+    """The underlying asyncpg.Pool, or None while disconnected."""
+    return getattr(db._backend, "_pool", None)
+
+
+def pool_snapshot(db: Database) -> dict:
+    pool = raw_pool(db)
+    size = pool.get_size() if pool else 0
+    idle = pool.get_idle_size() if pool else 0
+    return {
+        "connected": db.is_connected,
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "settings": asdict(pool_settings),
+        **pool_stats.as_dict(),
+    }
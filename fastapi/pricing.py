@@ -0,0 +1,273 @@
+"""
+Coin prices for vehicle/date ranges.
+
+A booking of N nights (N = max(1, end_date - start_date), like the booking
+page counts them) costs the sum over those nights of
+
+    coin_rate_per_day x weekday/weekend x season x surge
+
+rounded to whole coins. With the default rules every multiplier is 1, so
+the price is rate x nights -- what the frontend has always charged.
+
+Rules (environment):
+
+    PRICING_WEEKEND_MULTIPLIER  Friday and Saturday nights (default 1.0)
+    PRICING_SEASONS             JSON list of {"start": "MM-DD", "end": "MM-DD",
+                                "multiplier": x}, inclusive, may wrap New Year
+    PRICING_SURGE               JSON list of {"occupancy": f, "multiplier": x};
+                                the highest tier reached by that night's
+                                occupancy (booked / offered vehicles of the
+                                same type, from occupancy.py) applies
+
+For the next PRICING_HORIZON_DAYS nights the multipliers are precomputed
+per vehicle type as prefix sums, and each vehicle maps to (type, rate), so
+any quote is two array lookups and a multiplication whatever its length; a
+batch of hundreds is a loop of O(1) steps. The table is rebuilt in the
+background every PRICING_REFRESH_SECONDS, which is also how fast surge
+follows bookings. Vehicles created since are looked up on first quote.
+Nights outside the horizon are priced by the rules without surge.
+
+Each worker builds and refreshes its own table, so with surge on two
+workers can briefly quote the same dates differently. A quote therefore
+carries a quote_token, an HMAC (keyed with SESSION_SECRET, shared by every
+worker) over vehicle, dates, coins and expiry. A booking that sends the
+token back is held to the price it was quoted for PRICING_QUOTE_TTL
+seconds, whichever worker takes it; without a token coins_used has to
+match this worker's current quote. Enforcement is opt-in (PRICING_ENFORCE=1).
+"""
+from array import array
+from datetime import date, timedelta
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from cache import TTLCache
+import occupancy
+from sessions import SESSION_SECRET
+from statements import statements
+
+log = logging.getLogger(__name__)
+
+PRICING_HORIZON_DAYS = int(os.environ.get("PRICING_HORIZON_DAYS", 365))
+PRICING_REFRESH_SECONDS = float(os.environ.get("PRICING_REFRESH_SECONDS", 300))
+PRICING_WEEKEND_MULTIPLIER = float(os.environ.get("PRICING_WEEKEND_MULTIPLIER", 1.0))
+PRICING_SEASONS = json.loads(os.environ.get("PRICING_SEASONS", "[]"))
+PRICING_SURGE = sorted(
+    json.loads(os.environ.get("PRICING_SURGE", "[]")), key=lambda tier: tier["occupancy"]
+)
+# vehicles without a rate; the booking page falls back to the same number
+PRICING_DEFAULT_RATE = int(os.environ.get("PRICING_DEFAULT_RATE", 100))
+# reject bookings whose coins_used differs from the quote
+PRICING_ENFORCE = os.environ.get("PRICING_ENFORCE", "0") == "1"
+# seconds a quote_token holds its price
+PRICING_QUOTE_TTL = int(os.environ.get("PRICING_QUOTE_TTL", 900))
+
+PRICING_VEHICLES = statements.register(
+    "pricing.vehicles",
+    "SELECT id, type_of_car, coin_rate_per_day FROM public.vehicles",
+)
+PRICING_VEHICLES_BY_ID = statements.register(
+    "pricing.vehicles_by_id",
+    "SELECT id, type_of_car, coin_rate_per_day FROM public.vehicles WHERE id = ANY($1::int[])",
+)
+
+Vehicle = Tuple[str, int]  # (type_of_car, rate)
+
+
+def _md(value: str) -> Tuple[int, int]:
+    month, day = value.split("-")
+    return int(month), int(day)
+
+
+_SEASONS = [(_md(s["start"]), _md(s["end"]), float(s["multiplier"])) for s in PRICING_SEASONS]
+
+
+def rule_multiplier(night: date) -> float:
+    """Weekday/weekend x season multiplier of one night (no surge)."""
+    m = PRICING_WEEKEND_MULTIPLIER if night.weekday() in (4, 5) else 1.0
+    md = (night.month, night.day)
+    for start, end, mult in _SEASONS:
+        if (start <= md <= end) if start <= end else (md >= start or md <= end):
+            m *= mult
+    return m
+
+
+def surge_multiplier(occupancy_ratio: float) -> float:
+    m = 1.0
+    for tier in PRICING_SURGE:
+        if occupancy_ratio >= tier["occupancy"]:
+            m = float(tier["multiplier"])
+    return m
+
+
+# separate key, so a quote token is never mistaken for a session signature
+_QUOTE_KEY = hashlib.sha256(b"quote:" + SESSION_SECRET.encode()).digest()
+
+
+def _quote_signature(vehicle_id: int, start: str, end: str, coins: int, expires: int) -> str:
+    msg = f"{vehicle_id}:{start}:{end}:{coins}:{expires}".encode()
+    return hmac.new(_QUOTE_KEY, msg, hashlib.sha256).hexdigest()[:32]
+
+
+def quote_token(vehicle_id: int, start: str, end: str, coins: int, expires: int) -> str:
+    return f"{expires}.{_quote_signature(vehicle_id, start, end, coins, expires)}"
+
+
+def _token_holds(quote: dict, coins_used: int, token: str) -> bool:
+    """True if `token` was issued for this vehicle/dates at `coins_used` and hasn't expired."""
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = _quote_signature(
+        quote["vehicle_id"], quote["start_date"], quote["end_date"], coins_used, int(expires)
+    )
+    return hmac.compare_digest(signature, expected)
+
+
+class _Table:
+    __slots__ = ("base", "horizon", "prefix", "vehicles")
+
+    def __init__(self, base: date, horizon: int, prefix: Dict[str, array], vehicles: Dict[int, Vehicle]):
+        self.base = base
+        self.horizon = horizon
+        # prefix[type][i] = sum of the multipliers of nights base .. base+i-1
+        self.prefix = prefix
+        self.vehicles = vehicles
+
+
+def _vehicle(row) -> Vehicle:
+    rate = row["coin_rate_per_day"]
+    return row["type_of_car"], PRICING_DEFAULT_RATE if rate is None else rate
+
+
+class PricingEngine:
+    def __init__(self):
+        self._tables = TTLCache(
+            "pricing_tables", maxsize=1, ttl=PRICING_REFRESH_SECONDS, stale_ttl=PRICING_REFRESH_SECONDS,
+        )
+        self.quotes = 0
+
+    async def _build(self) -> _Table:
+        base = date.today()
+        last = base + timedelta(days=PRICING_HORIZON_DAYS - 1)
+        vehicles = {r["id"]: _vehicle(r) for r in await statements.fetch_all(PRICING_VEHICLES)}
+        rules = [rule_multiplier(base + timedelta(days=i)) for i in range(PRICING_HORIZON_DAYS)]
+        prefix: Dict[str, array] = {}
+        for type_of_car in {t for t, _ in vehicles.values()}:
+            mults = rules
+            if PRICING_SURGE:
+                fleet = await occupancy.fleet_availability(base, last, type_of_car)
+                mults = [
+                    m * surge_multiplier(d["booked"] / d["offered"] if d["offered"] > 0 else 0.0)
+                    for m, d in zip(rules, fleet["days"])
+                ]
+            prefix[type_of_car] = array("d", accumulate(mults, initial=0.0))
+        return _Table(base, PRICING_HORIZON_DAYS, prefix, vehicles)
+
+    async def _table(self) -> _Table:
+        table = await self._tables.get_or_load("table", self._build, stale_while_revalidate=True)
+        if table.base != date.today():
+            # the horizon starts today: rebuild once the date has moved on
+            self._tables.clear()
+            table = await self._tables.get_or_load("table", self._build)
+        return table
+
+    async def warm_up(self) -> None:
+        await self._table()
+
+    def _units(self, table: _Table, type_of_car: str, start: date, nights: int) -> float:
+        prefix = table.prefix.get(type_of_car)
+        s = (start - table.base).days
+        if prefix is not None and s >= 0 and s + nights <= table.horizon:
+            return prefix[s + nights] - prefix[s]
+        units = 0.0
+        for i in range(nights):
+            d = s + i
+            if prefix is not None and 0 <= d < table.horizon:
+                units += prefix[d + 1] - prefix[d]
+            else:
+                units += rule_multiplier(start + timedelta(days=i))
+        return units
+
+    async def quote_many(self, items: Iterable[Tuple[int, date, date]]) -> List[Optional[dict]]:
+        """A quote per (vehicle_id, start_date, end_date); None where the vehicle doesn't exist."""
+        items = list(items)
+        table = await self._table()
+        missing = {vid for vid, _, _ in items if vid not in table.vehicles}
+        if missing:
+            for r in await statements.fetch_all(PRICING_VEHICLES_BY_ID, sorted(missing)):
+                table.vehicles[r["id"]] = _vehicle(r)
+
+        quotes: List[Optional[dict]] = []
+        expires = int(time.time()) + PRICING_QUOTE_TTL
+        for vehicle_id, start, end in items:
+            vehicle = table.vehicles.get(vehicle_id)
+            if vehicle is None:
+                quotes.append(None)
+                continue
+            type_of_car, rate = vehicle
+            nights = max(1, (end - start).days)
+            coins = int(rate * self._units(table, type_of_car, start, nights) + 0.5)
+            start_s, end_s = start.isoformat(), end.isoformat()
+            quotes.append({
+                "vehicle_id": vehicle_id,
+                "start_date": start_s,
+                "end_date": end_s,
+                "nights": nights,
+                "coin_rate_per_day": rate,
+                "coins": coins,
+                "quote_token": quote_token(vehicle_id, start_s, end_s, coins, expires),
+                "expires_at": expires,
+            })
+        self.quotes += len(items)
+        return quotes
+
+    async def quote(self, vehicle_id: int, start: date, end: date) -> Optional[dict]:
+        return (await self.quote_many([(vehicle_id, start, end)]))[0]
+
+    def stats(self) -> dict:
+        table = self._tables.get("table")
+        return {
+            "quotes": self.quotes,
+            "base": table.base.isoformat() if table else None,
+            "horizon_days": PRICING_HORIZON_DAYS,
+            "vehicles": len(table.vehicles) if table else 0,
+            "types": sorted(table.prefix) if table else [],
+            "enforced": PRICING_ENFORCE,
+            "quote_ttl": PRICING_QUOTE_TTL,
+        }
+
+
+def price_error(quote: Optional[dict], coins_used: int, token: Optional[str] = None) -> Optional[str]:
+    """
+    Why `coins_used` is not accepted for this quote, or None. A valid
+    quote_token for exactly these coins wins over the current table.
+    """
+    if not PRICING_ENFORCE or quote is None or coins_used == quote["coins"]:
+        return None
+    if token and _token_holds(quote, coins_used, token):
+        return None
+    return f"coins_used must be {quote['coins']} for these dates (see GET /quote)."
+
+
+pricing = PricingEngine()
+
+
+async def booking_price_errors(
+    items: Iterable[Tuple[int, date, date, int, Optional[str]]],
+) -> List[Optional[str]]:
+    """
+    price_error() per (vehicle_id, start_date, end_date, coins_used,
+    quote_token). Quotes only while PRICING_ENFORCE is on, so by default
+    bookings never touch the rate table; raises if it can't be built.
+    """
+    items = list(items)
+    if not PRICING_ENFORCE:
+        return [None] * len(items)
+    quotes = await pricing.quote_many((vid, start, end) for vid, start, end, _, _ in items)
+    return [price_error(q, coins, token) for q, (_, _, _, coins, token) in zip(quotes, items)]
@@ -0,0 +1,155 @@
+"""
+Versioned cache of serialized JSON responses, with strong ETags.
+
+A cached entry is the finished body bytes plus its headers, keyed by the
+caller's key (route + query parameters) and the current versions of the
+data it depends on. Writers bump a version instead of hunting down keys:
+
+    await vehicle_responses.bump("catalog")     # vehicles created / changed
+    await vehicle_responses.bump("bookings")    # bookings changed
+
+so later lookups miss and the old entries age out of the LRU.
+
+Versions live in Postgres sequences (public.response_version_<scope>,
+schema.py), so a write on one worker invalidates every worker's entries.
+bump() runs nextval after the write committed and the bumping worker sees
+its own write at once; the others re-read the versions at most every
+RESPONSE_VERSION_INTERVAL seconds (default 1), which bounds how long they
+can serve a page from before the write.
+
+The ETag is a hash of the body, so it is the same on every worker for the
+same data and a matching If-None-Match gets a 304 without a body. Responses
+go out with Cache-Control no-cache unless a max_age is configured, so
+clients revalidate (cheaply, by ETag) instead of trusting their copy.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+import hashlib
+import logging
+import os
+import time
+
+from fastapi import Request, Response
+
+from cache import TTLCache
+from record_json import JSON_MEDIA_TYPE, dumps
+from statements import statements
+
+log = logging.getLogger(__name__)
+
+RESPONSE_VERSION_INTERVAL = float(os.environ.get("RESPONSE_VERSION_INTERVAL", 1))
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body: bytes, headers: Dict[str, str]):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.headers = headers
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak validators (W/"...") compare equal for If-None-Match
+    candidates = (c.strip() for c in if_none_match.split(","))
+    return any(c == etag or c == "W/" + etag for c in candidates)
+
+
+class ResponseCache:
+    def __init__(self, name: str, scopes: Iterable[str], maxsize: int, ttl: float, max_age: int):
+        self._cache = TTLCache(name, maxsize=maxsize, ttl=ttl)
+        self.max_age = max_age
+        self._versions: Dict[str, int] = {scope: 0 for scope in scopes}
+        self._versions_at = float("-inf")
+        self._read_versions = statements.register(
+            f"{name}.versions",
+            "SELECT " + ", ".join(
+                f"(SELECT last_value FROM public.response_version_{scope}) AS {scope}"
+                for scope in self._versions
+            ),
+        )
+        self._bumps = {
+            scope: statements.register(
+                f"{name}.bump.{scope}", f"SELECT nextval('public.response_version_{scope}')"
+            )
+            for scope in self._versions
+        }
+        self.not_modified = 0
+
+    async def bump(self, *scopes: str) -> None:
+        """Call after the write committed."""
+        for scope in scopes:
+            try:
+                version = await statements.fetch_val(self._bumps[scope])
+            except Exception as e:
+                # can't tell the other workers; at least stop serving stale here
+                log.warning("response cache version bump failed (%s): %s", scope, e)
+                self._cache.clear()
+                continue
+            self._versions[scope] = max(self._versions[scope], version)
+
+    async def _current(self, depends_on: Iterable[str]) -> Tuple[int, ...]:
+        now = time.monotonic()
+        if now - self._versions_at >= RESPONSE_VERSION_INTERVAL:
+            # set first, so concurrent requests don't all go and read them
+            self._versions_at = now
+            try:
+                row = await statements.fetch_one(self._read_versions)
+                for scope in self._versions:
+                    self._versions[scope] = max(self._versions[scope], row[scope])
+            except Exception as e:
+                log.warning("response cache versions unavailable: %s", e)
+        return tuple(self._versions[scope] for scope in depends_on)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    async def respond(
+        self,
+        request: Request,
+        key: Hashable,
+        depends_on: Iterable[str],
+        loader: Callable[[], Awaitable[Tuple[Any, Dict[str, str]]]],
+        private: bool = False,
+    ) -> Response:
+        """
+        Serve `key` from the cache, or call loader() -> (payload, extra headers)
+        and cache its serialized form; the payload may hold Records (see
+        record_json). `depends_on` names the scopes whose versions the payload
+        depends on; `private` is for per-viewer responses.
+        """
+        versions = await self._current(depends_on)
+
+        async def load() -> CachedBody:
+            payload, headers = await loader()
+            body = dumps(payload)
+            return CachedBody(body, headers)
+
+        entry: CachedBody = await self._cache.get_or_load((key, versions), load)
+        headers = {
+            **entry.headers,
+            "ETag": entry.etag,
+            "Cache-Control": f"{'private' if private else 'public'}, "
+                             + (f"max-age={self.max_age}" if self.max_age > 0 else "no-cache"),
+        }
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+    def stats(self) -> dict:
+        return {"versions": dict(self._versions), "not_modified": self.not_modified}
+
+
+# GET /vehicles and /vehicles/{id}
+vehicle_responses = ResponseCache(
+    "vehicle_responses",
+    scopes=("catalog", "bookings"),
+    maxsize=int(os.environ.get("VEHICLE_RESPONSE_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("VEHICLE_RESPONSE_CACHE_TTL", 60)),
+    # seconds clients may reuse a page without asking; 0 = always revalidate
+    max_age=int(os.environ.get("VEHICLE_RESPONSE_MAX_AGE", 0)),
+)
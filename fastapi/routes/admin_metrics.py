@@ -1,36 +1,145 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 from datetime import date
 from database import database
+from response_cache import vehicle_responses
+import occupancy
+from pool import pool_snapshot
+from statements import statements
+from schema import REBUILD_METRIC_COUNTERS
+from cache import TTLCache, cache_stats
+from balance_cache import balance_cache
+from events import BookingCreated, bus, outbox
+from pricing import pricing
+from instrumentation import metrics as request_metrics, prom_series, render_prometheus
+import os
 
 admin_router = APIRouter(prefix="/admin", tags=["admin"])
 
+# ---- Summary metrics ----
+# Counters live in public.metric_counters, so a refresh is two tiny indexed
+# queries instead of four full-table aggregates. Statement triggers keep the
+# users/vehicles counts and booking deletes/updates (schema.py); new bookings
+# reach 'rentals' and 'spending' through the outbox worker (events.py).
+METRICS_TTL = float(os.environ.get("METRICS_CACHE_TTL", 5))
+METRICS_STALE_TTL = float(os.environ.get("METRICS_STALE_TTL", 60))
+METRICS_STALE_WHILE_REVALIDATE = os.environ.get("METRICS_STALE_WHILE_REVALIDATE", "1") == "1"
+
+_metrics_cache = TTLCache("admin_metrics", maxsize=1, ttl=METRICS_TTL, stale_ttl=METRICS_STALE_TTL)
+
+COUNTERS = statements.register(
+    "admin.counters",
+    "SELECT name, SUM(value)::bigint AS value FROM public.metric_counters GROUP BY name",
+)
+# vehicles booked today; served by bookings_period_gist
+BOOKED_TODAY = statements.register(
+    "admin.booked_today",
+    """
+    SELECT COUNT(DISTINCT b.vehicle_id)
+    FROM public.bookings b
+    WHERE daterange(b.start_date, b.end_date, '[]') @> $1::date
+    """,
+)
+
+async def _load_metrics() -> dict:
+    counters = {r["name"]: r["value"] for r in await statements.fetch_all(COUNTERS)}
+    booked_today = await statements.fetch_val(BOOKED_TODAY, date.today())
+    return {
+        "total_users": counters.get("users", 0),
+        "total_rentals": counters.get("rentals", 0),
+        "total_spending": int(counters.get("spending", 0)),
+        # count available vehicles (not booked at current date)
+        "available_vehicles": max(counters.get("vehicles", 0) - (booked_today or 0), 0),
+    }
+
+async def _rentals_changed(event: BookingCreated) -> None:
+    # published once the outbox batch that bumped the counters has committed,
+    # so the next /admin/metrics here reads them instead of waiting out the
+    # TTL (other workers still do)
+    _metrics_cache.clear()
+
+bus.subscribe(BookingCreated.topic, _rentals_changed)
+
 @admin_router.get("/metrics")
 async def metrics():
-    today = date.today()
-
-    users_q = "SELECT COUNT(*) AS c FROM users"
-    rentals_q = "SELECT COUNT(*) AS c FROM public.bookings"
-    spending_q = "SELECT COALESCE(SUM(coins_used),0) AS s FROM public.bookings"
-
-    users = await database.fetch_one(users_q)
-    rentals = await database.fetch_one(rentals_q)
-    spending = await database.fetch_one(spending_q)
-
-    # count available vehicles (not booked at current date)
-    available_q = """
-        SELECT COUNT(*) AS c
-        FROM public.vehicles v
-        WHERE NOT EXISTS (
-            SELECT 1 FROM public.bookings b
-            WHERE b.vehicle_id = v.id
-              AND :today BETWEEN b.start_date AND b.end_date
-        )
-    """
-    available = await database.fetch_one(available_q, {"today": today})
+    return await _metrics_cache.get_or_load(
+        "metrics", _load_metrics, stale_while_revalidate=METRICS_STALE_WHILE_REVALIDATE
+    )
 
+@admin_router.post("/metrics/rebuild")
+async def metrics_rebuild():
+    """Recompute the summary counters from the base tables (full scan, use sparingly)."""
+    async with database.transaction():
+        for stmt in REBUILD_METRIC_COUNTERS:
+            await database.execute(stmt)
+    _metrics_cache.clear()
+    return await metrics()
+
+@admin_router.get("/caches")
+async def caches():
     return {
-        "total_users": users["c"] if users else 0,
-        "total_rentals": rentals["c"] if rentals else 0,
-        "total_spending": int(spending["s"] if spending else 0),
-        "available_vehicles": available["c"] if available else 0,
+        **cache_stats(),
+        "balance_cache": balance_cache.stats(),
+        "vehicle_responses_versions": vehicle_responses.stats(),
+    }
+
+@admin_router.post("/caches/expire")
+async def caches_expire():
+    """Expire the caches derived from bookings, e.g. after editing bookings by hand."""
+    occupancy.clear()
+    await vehicle_responses.bump("bookings")
+    return await caches()
+
+@admin_router.get("/events")
+async def event_stats():
+    """Outbox backlog, drain throughput and event bus stats (see events.py)."""
+    return await outbox.stats()
+
+@admin_router.get("/pricing")
+async def pricing_stats():
+    return pricing.stats()
+
+@admin_router.get("/pool")
+async def pool_stats():
+    """Connection pool usage: size / idle / in_use and time spent waiting to acquire."""
+    return pool_snapshot(database)
+
+@admin_router.get("/statements")
+async def statement_stats():
+    """Per registered statement: calls, errors and latency."""
+    return statements.stats()
+
+# ---- Request / query instrumentation (see instrumentation.py) ----
+@admin_router.get("/requests")
+async def request_stats():
+    return request_metrics.request_summary()
+
+@admin_router.get("/prom", response_class=PlainTextResponse)
+async def prometheus():
+    """Prometheus text exposition: request and query histograms, pool and cache stats."""
+    pool = pool_snapshot(database)
+    gauges = {
+        prom_series("db_pool_connections", state=state): pool[state]
+        for state in ("size", "idle", "in_use")
+    }
+    gauges[prom_series("db_pool_waiting")] = pool["waiting"]
+    counters = {
+        prom_series("db_pool_acquires_total"): pool["acquires"],
+        prom_series("db_pool_acquire_errors_total"): pool["acquire_errors"],
+        prom_series("db_pool_acquire_wait_seconds_total"): pool["wait_total_s"],
     }
+    for name, stats in cache_stats().items():
+        for kind in ("hits", "stale_hits", "misses", "evictions"):
+            counters[prom_series(f"cache_{kind}_total", cache=name)] = stats[kind]
+        gauges[prom_series("cache_entries", cache=name)] = stats["size"]
+    events = await outbox.stats()
+    if events["pending"] is not None:
+        gauges[prom_series("event_outbox_pending")] = events["pending"]
+    gauges[prom_series("event_bus_queued")] = events["bus"]["queued"]
+    counters[prom_series("event_outbox_events_total")] = events["events"]
+    counters[prom_series("event_outbox_failures_total")] = events["failures"]
+    counters[prom_series("event_bus_handler_errors_total")] = events["bus"]["handler_errors"]
+    return PlainTextResponse(
+        render_prometheus(gauges, counters),
+        media_type="text/plain; version=0.0.4",
+    )
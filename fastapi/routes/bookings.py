@@ -1,38 +1,309 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
-from typing import Optional
-from datetime import date, datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Literal
+from datetime import date
+from contextlib import nullcontext
 from database import database
+from response_cache import vehicle_responses
+import occupancy
+from balance_cache import balance_cache
+from cache import TTLCache
+from events import outbox
+from pricing import booking_price_errors
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, is_cursor_int, split_page
+from sessions import authorize, session_user
+from statements import statements
+from record_json import RecordsJSONResponse
+import asyncpg
+import itertools
 import logging
+import os
 
 router = APIRouter(prefix="", tags=["bookings"])
 log = logging.getLogger(__name__)
 
+BOOKING_BATCH_MAX = int(os.environ.get("BOOKING_BATCH_MAX", 100))
+# Serialize bookings per vehicle with transaction-scoped advisory locks, for
+# databases without the bookings_no_overlap exclusion constraint (schema.py).
+# Requests that also check the user's own bookings take the lock regardless.
+BOOKING_ADVISORY_LOCKS = os.environ.get("BOOKING_ADVISORY_LOCKS", "0") == "1"
+BOOKING_LOCK_CLASS = 7342  # advisory lock namespace: (BOOKING_LOCK_CLASS, vehicle_id)
+
+OVERLAP_DETAIL = "Requested dates overlap an existing booking."
+MY_BOOKINGS_CACHE_TTL = float(os.environ.get("MY_BOOKINGS_CACHE_TTL", 10))
+
 class BookingBody(BaseModel):
     vehicle_id: int
     start_date: date
     end_date: date
     username: str
     coins_used: int = 0
+    # quote_token of the GET /quote that priced coins_used (pricing.py)
+    quote_token: Optional[str] = None
     # NEW: allow the same user to overlap (useful for testing)
     allow_same_user_overlap: bool = False
 
-def _overlap_sql(allow_same_user_overlap: bool) -> str:
-    """
-    Exclusive overlap (back-to-back allowed):
-      Overlap iff NOT (new_end < start OR new_start > end)
+class BatchBookingItem(BaseModel):
+    vehicle_id: int
+    start_date: date
+    end_date: date
+    coins_used: int = 0
+    quote_token: Optional[str] = None
+
+class BatchBookingBody(BaseModel):
+    username: str = Field(..., min_length=1)
+    items: List[BatchBookingItem] = Field(..., min_length=1, max_length=BOOKING_BATCH_MAX)
+    # all_or_nothing: any failing item rolls back the whole batch
+    # best_effort: book what can be booked, report the rest per item
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+    allow_same_user_overlap: bool = False
 
-    If allow_same_user_overlap = True, we IGNORE rows by the same username.
+# ---- Hot statements (see statements.py) ----
+# Whole booking in one statement / one round-trip: validate user and vehicle
+# window, check overlap, insert the booking, debit coins and write the ledger
+# row, and queue the BookingCreated / CoinsChanged events (events.py). The
+# final SELECT reports why nothing was inserted so create_booking can map it
+# to the usual 404 / 400 / 409.
+#   $1 vehicle_id  $2 start_date  $3 end_date  $4 username  $5 coins_used
+#   $6 username whose bookings are ignored by the overlap check (NULL = none)
+# Exclusive overlap (back-to-back allowed):
+#   Overlap iff NOT (new_end < start OR new_start > end)
+CREATE_BOOKING = statements.register(
+    "bookings.create",
     """
-    same_user_clause = "" if allow_same_user_overlap else "AND b.username IS DISTINCT FROM :username"
-    return f"""
+    WITH u AS (
+      SELECT username FROM public.users WHERE username = $4::text
+    ),
+    v AS (
+      SELECT id, rent_start_date::date AS rs, rent_end_date::date AS re
+      FROM public.vehicles
+      WHERE id = $1::int
+    ),
+    clash AS (
       SELECT 1
       FROM public.bookings b
-      WHERE b.vehicle_id = :vehicle_id
-        {same_user_clause}
-        AND NOT (:end_date < b.start_date OR :start_date > b.end_date)
+      WHERE b.vehicle_id = $1::int
+        AND NOT ($3::date < b.start_date OR $2::date > b.end_date)
+        AND ($6::text IS NULL OR b.username IS DISTINCT FROM $6::text)
       LIMIT 1
+    ),
+    ok AS (
+      SELECT 1
+      FROM u, v
+      WHERE (v.rs IS NULL OR $2::date >= v.rs)
+        AND (v.re IS NULL OR $3::date <= v.re)
+        AND NOT EXISTS (SELECT 1 FROM clash)
+    ),
+    debit AS (
+      UPDATE public.users
+      SET coin_balance = coin_balance - $5::int
+      WHERE username = $4::text
+        AND $5::int > 0
+        AND coin_balance >= $5::int
+        AND EXISTS (SELECT 1 FROM ok)
+      RETURNING coin_balance
+    ),
+    ins AS (
+      INSERT INTO public.bookings (vehicle_id, username, start_date, end_date, coins_used)
+      SELECT $1::int, $4::text, $2::date, $3::date, $5::int
+      FROM ok
+      WHERE $5::int = 0 OR EXISTS (SELECT 1 FROM debit)
+      RETURNING id, vehicle_id, username,
+                start_date::text AS start_date,
+                end_date::text   AS end_date,
+                coins_used, created_at
+    ),
+    ledger AS (
+      INSERT INTO public.coin_transactions
+        (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
+      SELECT $4::text, -$5::int, 'rental', 'booking', ins.id::text, debit.coin_balance, NULL
+      FROM ins, debit
+      RETURNING username, change_amount, reason, reference_type, reference_id, balance_after
+    ),
+    events AS (
+      INSERT INTO public.event_outbox (topic, payload)
+      SELECT 'BookingCreated', jsonb_build_object(
+               'booking_id', ins.id, 'vehicle_id', ins.vehicle_id, 'username', ins.username,
+               'start_date', ins.start_date, 'end_date', ins.end_date, 'coins_used', ins.coins_used)
+      FROM ins
+      UNION ALL
+      SELECT 'CoinsChanged', to_jsonb(ledger) FROM ledger
+    )
+    SELECT
+      EXISTS (SELECT 1 FROM u)             AS user_found,
+      EXISTS (SELECT 1 FROM v)             AS vehicle_found,
+      (SELECT rs FROM v)                   AS rent_start_date,
+      (SELECT re FROM v)                   AS rent_end_date,
+      EXISTS (SELECT 1 FROM clash)         AS overlap,
+      (SELECT coin_balance FROM debit)     AS coin_balance,
+      ins.id, ins.vehicle_id, ins.username, ins.start_date, ins.end_date,
+      ins.coins_used, ins.created_at
+    FROM (SELECT 1) AS one
+    LEFT JOIN ins ON true
+    """,
+)
+DEBIT_BALANCE = statements.register(
+    "bookings.debit_balance",
+    """
+    UPDATE public.users
+    SET coin_balance = coin_balance - $1
+    WHERE username = $2 AND coin_balance >= $1
+    RETURNING coin_balance
+    """,
+)
+VEHICLE_LOCK = statements.register(
+    "bookings.vehicle_lock",
+    "SELECT pg_advisory_xact_lock($1::int, $2::int)",
+)
+VEHICLE_LOCKS = statements.register(
+    "bookings.vehicle_locks",
+    """
+    SELECT pg_advisory_xact_lock($1::int, id)
+    FROM unnest($2::int[]) AS id
+    ORDER BY id
+    """,
+)
+
+# ---- Batch statements: one round-trip per step, whatever the batch size ----
+LOCK_USER = statements.register(
+    "bookings.batch.lock_user",
+    "SELECT coin_balance FROM public.users WHERE username = $1 FOR UPDATE",
+)
+# deterministic (id) lock order so concurrent batches can't deadlock
+LOCK_VEHICLES = statements.register(
+    "bookings.batch.lock_vehicles",
+    """
+    SELECT id, rent_start_date::date AS rent_start_date, rent_end_date::date AS rent_end_date
+    FROM public.vehicles
+    WHERE id = ANY($1::int[])
+    ORDER BY id
+    FOR UPDATE
+    """,
+)
+# indexes of the requested ranges that overlap an existing booking;
+# $5 = username whose bookings are ignored (NULL = check everyone's)
+BATCH_OVERLAPS = statements.register(
+    "bookings.batch.overlaps",
+    """
+    SELECT r.idx
+    FROM unnest($1::int[], $2::int[], $3::date[], $4::date[]) AS r(idx, vehicle_id, start_date, end_date)
+    WHERE EXISTS (
+      SELECT 1
+      FROM public.bookings b
+      WHERE b.vehicle_id = r.vehicle_id
+        AND daterange(b.start_date, b.end_date, '[]') && daterange(r.start_date, r.end_date, '[]')
+        AND ($5::text IS NULL OR b.username IS DISTINCT FROM $5::text)
+    )
+    """,
+)
+# the bookings plus their BookingCreated events for the outbox (events.py)
+BATCH_INSERT = statements.register(
+    "bookings.batch.insert",
+    """
+    WITH ins AS (
+      INSERT INTO public.bookings (vehicle_id, username, start_date, end_date, coins_used)
+      SELECT r.vehicle_id, $1, r.start_date, r.end_date, r.coins_used
+      FROM unnest($2::int[], $3::date[], $4::date[], $5::int[])
+           WITH ORDINALITY AS r(vehicle_id, start_date, end_date, coins_used, ord)
+      ORDER BY r.ord
+      RETURNING id, vehicle_id, username,
+                start_date::text AS start_date,
+                end_date::text   AS end_date,
+                coins_used, created_at
+    ),
+    events AS (
+      INSERT INTO public.event_outbox (topic, payload)
+      SELECT 'BookingCreated', jsonb_build_object(
+               'booking_id', id, 'vehicle_id', vehicle_id, 'username', username,
+               'start_date', start_date, 'end_date', end_date, 'coins_used', coins_used)
+      FROM ins
+      ORDER BY id
+    )
+    SELECT * FROM ins ORDER BY id
+    """,
+)
+BATCH_LEDGER = statements.register(
+    "bookings.batch.ledger",
     """
+    WITH ledger AS (
+      INSERT INTO public.coin_transactions
+        (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
+      SELECT $1, r.change_amount, 'rental', 'booking', r.reference_id, r.balance_after, NULL
+      FROM unnest($2::int[], $3::text[], $4::int[]) AS r(change_amount, reference_id, balance_after)
+      RETURNING username, change_amount, reason, reference_type, reference_id, balance_after
+    )
+    INSERT INTO public.event_outbox (topic, payload)
+    SELECT 'CoinsChanged', to_jsonb(ledger) FROM ledger
+    """,
+)
+
+# "My trips", newest first, one page at a time. Each status is a range on
+# the (username, start_date DESC, id DESC) index, so a page costs the same
+# however long the history is (ongoing can also use (username, end_date)):
+#   upcoming   start_date > today
+#   ongoing    start_date <= today <= end_date
+#   completed  end_date < today   (so also start_date < today)
+#   $1 username  $2 limit  [$3 start_date  $4 id of the previous page's last row]
+_MINE_SELECT = """
+    SELECT
+        b.id,
+        b.vehicle_id,
+        v.brand,
+        v.model,
+        v.image_url,
+        b.start_date::text AS start_date,
+        b.end_date::text AS end_date,
+        CASE
+            WHEN b.start_date > CURRENT_DATE THEN 'upcoming'
+            WHEN b.end_date < CURRENT_DATE THEN 'completed'
+            ELSE 'ongoing'
+        END AS status
+    FROM public.bookings b
+    JOIN public.vehicles v ON v.id = b.vehicle_id
+    WHERE b.username = $1 {status} {after}
+    ORDER BY b.start_date DESC, b.id DESC
+    LIMIT $2
+"""
+_MINE_STATUS = {
+    None: "",
+    "upcoming": "AND b.start_date > CURRENT_DATE",
+    "ongoing": "AND b.start_date <= CURRENT_DATE AND b.end_date >= CURRENT_DATE",
+    "completed": "AND b.start_date < CURRENT_DATE AND b.end_date < CURRENT_DATE",
+}
+MY_BOOKINGS = {
+    (status, keyset): statements.register(
+        f"bookings.mine.{status or 'all'}{'.after' if keyset else ''}",
+        _MINE_SELECT.format(
+            status=where,
+            after="AND (b.start_date, b.id) < ($3, $4)" if keyset else "",
+        ),
+    )
+    for status, where in _MINE_STATUS.items()
+    for keyset in (False, True)
+}
+
+# pages of /bookings/mine per user; a user's booking writes bump their
+# generation (part of the key), other workers catch up after the TTL.
+# Generations come from one counter, so a value never repeats, and only
+# have to outlive the pages cached before the write, so they expire too.
+_mine_cache = TTLCache("my_bookings", maxsize=8192, ttl=MY_BOOKINGS_CACHE_TTL)
+_mine_generation = TTLCache("my_bookings_generation", maxsize=100_000, ttl=MY_BOOKINGS_CACHE_TTL)
+_generations = itertools.count(1)
+
+async def _price_errors(items) -> List[Optional[str]]:
+    try:
+        return await booking_price_errors(items)
+    except Exception:
+        log.exception("pricing check failed")
+        raise HTTPException(503, "Pricing is unavailable, try again shortly.")
+
+async def _bookings_changed(vehicle_ids, username: Optional[str] = None) -> None:
+    """Expire caches derived from bookings (calendars, fleet counts, listings, my trips)."""
+    occupancy.bookings_changed(vehicle_ids)
+    await vehicle_responses.bump("bookings")
+    if username is not None:
+        _mine_generation.set(username, next(_generations))
 
 @router.post("/bookings")
 async def create_booking(
@@ -41,9 +312,11 @@ async def create_booking(
     end_date: Optional[date] = Query(None),
     username: Optional[str] = Query(None),
     coins_used: Optional[int] = Query(0),
+    quote_token: Optional[str] = Query(None),
     # NEW: query toggle mirrors body field
     allow_same_user_overlap: Optional[bool] = Query(False),
     body: Optional[BookingBody] = None,
+    session_username: Optional[str] = Depends(session_user),
 ):
     # allow JSON body
     if body:
@@ -52,6 +325,7 @@ async def create_booking(
         end_date = body.end_date
         username = body.username
         coins_used = body.coins_used or 0
+        quote_token = body.quote_token
         allow_same_user_overlap = body.allow_same_user_overlap
 
     # basic validation
@@ -61,141 +335,264 @@ async def create_booking(
         raise HTTPException(422, "end_date must be on/after start_date.")
     if not username:
         raise HTTPException(422, "username is required.")
+    authorize(session_username, username)
     if coins_used is None or coins_used < 0:
         raise HTTPException(422, "coins_used must be >= 0.")
+    # an unknown vehicle gets no quote and still ends in the statement's 404
+    (error,) = await _price_errors([(vehicle_id, start_date, end_date, coins_used, quote_token)])
+    if error:
+        raise HTTPException(400, error)
+
+    ignore_user = None if allow_same_user_overlap else username
+    # bookings_no_overlap only compares different users, so the same-user
+    # check is the CTE's own and needs the lock to be race-free
+    lock_vehicle = BOOKING_ADVISORY_LOCKS or ignore_user is None
 
     try:
-        async with database.transaction():
-            # user exists?
-            urow = await database.fetch_one(
-                "SELECT username, coin_balance FROM public.users WHERE username = :u",
-                {"u": username},
+        async with database.transaction() if lock_vehicle else nullcontext():
+            if lock_vehicle:
+                # the CTE below takes its snapshot after the lock is granted
+                await statements.execute(VEHICLE_LOCK, BOOKING_LOCK_CLASS, vehicle_id)
+            row = await statements.fetch_one(
+                CREATE_BOOKING,
+                vehicle_id, start_date, end_date, username, coins_used or 0,
+                ignore_user,
             )
-            if not urow:
+    except asyncpg.exceptions.ExclusionViolationError:
+        # lost a race against a concurrent booking (bookings_no_overlap)
+        raise HTTPException(409, OVERLAP_DETAIL)
+    except Exception as e:
+        log.exception("create_booking failed")
+        raise HTTPException(500, f"create_booking error: {e}")
+
+    if row["id"] is None:
+        if not row["user_found"]:
+            raise HTTPException(404, f"User '{username}' not found")
+        if not row["vehicle_found"]:
+            raise HTTPException(404, f"Vehicle {vehicle_id} not found.")
+        v_from = row["rent_start_date"]
+        v_to   = row["rent_end_date"]
+        if v_from and start_date < v_from:
+            raise HTTPException(400, f"start_date is before vehicle availability ({v_from}).")
+        if v_to and end_date > v_to:
+            raise HTTPException(400, f"end_date is after vehicle availability ({v_to}).")
+        if row["overlap"]:
+            raise HTTPException(409, OVERLAP_DETAIL)
+        await balance_cache.invalidate(username)
+        raise HTTPException(400, "Insufficient coins")
+
+    outbox.notify()
+    await _bookings_changed([vehicle_id], username)
+    if row["coin_balance"] is not None:
+        await balance_cache.written(username, row["coin_balance"])
+    booking = {
+        k: row[k]
+        for k in ("id", "vehicle_id", "username", "start_date", "end_date", "coins_used", "created_at")
+    }
+    return {"booking": booking}
+
+class _BatchAborted(Exception):
+    """all_or_nothing batch with a failing item: roll the transaction back."""
+
+@router.post("/bookings/batch")
+async def create_bookings_batch(
+    body: BatchBookingBody,
+    session_username: Optional[str] = Depends(session_user),
+):
+    """
+    Reserve many vehicle/date ranges for one user in one transaction.
+
+    Ranges are checked with set-based SQL, the affected vehicles are locked in
+    id order, and bookings, the coin debit and ledger rows are written with
+    one statement each. Returns a result per item (same status codes as
+    POST /bookings). In all_or_nothing mode any failure rolls back everything
+    and the response carries the first failing item's status code.
+    """
+    username = body.username
+    authorize(session_username, username)
+    items = body.items
+    results: List[Optional[dict]] = [None] * len(items)
+
+    def fail(i: int, status: int, detail: str):
+        results[i] = {"index": i, "ok": False, "status": status, "detail": detail}
+
+    for i, it in enumerate(items):
+        if it.end_date < it.start_date:
+            fail(i, 422, "end_date must be on/after start_date.")
+        elif it.coins_used < 0:
+            fail(i, 422, "coins_used must be >= 0.")
+
+    priced = [i for i in range(len(items)) if not results[i]]
+    errors = await _price_errors(
+        (items[i].vehicle_id, items[i].start_date, items[i].end_date, items[i].coins_used, items[i].quote_token)
+        for i in priced
+    )
+    for i, error in zip(priced, errors):
+        if error:
+            fail(i, 400, error)
+
+    all_or_nothing = body.mode == "all_or_nothing"
+    ignore_user = None if body.allow_same_user_overlap else username
+
+    booked: List[dict] = []
+    balance_after: Optional[int] = None
+    try:
+        async with database.transaction():
+            balance = await statements.fetch_val(LOCK_USER, username)
+            if balance is None:
                 raise HTTPException(404, f"User '{username}' not found")
 
-            # vehicle exists & availability
-            vrow = await database.fetch_one(
-                """
-                SELECT id, rent_start_date::date AS rent_start_date, rent_end_date::date AS rent_end_date
-                FROM public.vehicles
-                WHERE id = :id
-                """,
-                {"id": vehicle_id},
-            )
-            if not vrow:
-                raise HTTPException(404, f"Vehicle {vehicle_id} not found.")
-
-            v_from = vrow["rent_start_date"]
-            v_to   = vrow["rent_end_date"]
-            if v_from and start_date < v_from:
-                raise HTTPException(400, f"start_date is before vehicle availability ({v_from}).")
-            if v_to and end_date > v_to:
-                raise HTTPException(400, f"end_date is after vehicle availability ({v_to}).")
-
-            # prevent overlap (exclusive logic, optional same-user ignore)
-            exists = await database.fetch_one(
-                _overlap_sql(allow_same_user_overlap=bool(allow_same_user_overlap)),
-                {
-                    "vehicle_id": vehicle_id,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                    "username": username,  # needed for IS DISTINCT FROM
-                },
-            )
-            if exists:
-                raise HTTPException(409, "Requested dates overlap an existing booking.")
-
-            # 1) insert booking
-            booking = await database.fetch_one(
-                """
-                INSERT INTO public.bookings
-                  (vehicle_id, username, start_date, end_date, coins_used)
-                VALUES
-                  (:a_vid, :b_user, :c_start, :d_end, :e_coins)
-                RETURNING id, vehicle_id, username,
-                          start_date::text AS start_date,
-                          end_date::text   AS end_date,
-                          coins_used, created_at
-                """,
-                {
-                    "a_vid": vehicle_id,
-                    "b_user": username,
-                    "c_start": start_date,
-                    "d_end": end_date,
-                    "e_coins": coins_used or 0,
-                },
-            )
-            booking_id = booking["id"]
-
-            # 2) deduct coins + ledger (if needed)
-            if coins_used and coins_used > 0:
-                new_balance = await database.fetch_val(
-                    """
-                    UPDATE public.users
-                    SET coin_balance = coin_balance - :a_amt
-                    WHERE username = :b_user AND coin_balance >= :a_amt
-                    RETURNING coin_balance
-                    """,
-                    {"a_amt": coins_used, "b_user": username},
+            vehicle_ids = sorted({it.vehicle_id for it in items})
+            windows = {r["id"]: r for r in await statements.fetch_all(LOCK_VEHICLES, vehicle_ids)}
+            # same-user overlaps are checked by BATCH_OVERLAPS alone (see create_booking)
+            if BOOKING_ADVISORY_LOCKS or ignore_user is None:
+                await statements.execute(VEHICLE_LOCKS, BOOKING_LOCK_CLASS, vehicle_ids)
+            for i, it in enumerate(items):
+                if results[i]:
+                    continue
+                vrow = windows.get(it.vehicle_id)
+                if not vrow:
+                    fail(i, 404, f"Vehicle {it.vehicle_id} not found.")
+                elif vrow["rent_start_date"] and it.start_date < vrow["rent_start_date"]:
+                    fail(i, 400, f"start_date is before vehicle availability ({vrow['rent_start_date']}).")
+                elif vrow["rent_end_date"] and it.end_date > vrow["rent_end_date"]:
+                    fail(i, 400, f"end_date is after vehicle availability ({vrow['rent_end_date']}).")
+
+            pending = [i for i in range(len(items)) if not results[i]]
+            if pending:
+                clashes = await statements.fetch_all(
+                    BATCH_OVERLAPS,
+                    pending,
+                    [items[i].vehicle_id for i in pending],
+                    [items[i].start_date for i in pending],
+                    [items[i].end_date for i in pending],
+                    ignore_user,
                 )
-                if new_balance is None:
-                    raise HTTPException(400, "Insufficient coins")
-
-                await database.execute(
-                    """
-                    INSERT INTO public.coin_transactions
-                      (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
-                    VALUES
-                      (:a_user, :b_chg, :c_reason, :d_rtype, :e_rid, :f_after, :g_meta)
-                    """,
-                    {
-                        "a_user": username,
-                        "b_chg": -coins_used,
-                        "c_reason": "rental",
-                        "d_rtype": "booking",
-                        "e_rid": str(booking_id),
-                        "f_after": new_balance,
-                        "g_meta": None,
-                    },
+                for r in clashes:
+                    fail(r["idx"], 409, OVERLAP_DETAIL)
+
+            # ranges within the batch only clash when same-user rows are checked too
+            accepted: List[int] = []
+            spend = 0
+            for i in range(len(items)):
+                if results[i]:
+                    continue
+                it = items[i]
+                if ignore_user is None and any(
+                    items[j].vehicle_id == it.vehicle_id
+                    and not (it.end_date < items[j].start_date or it.start_date > items[j].end_date)
+                    for j in accepted
+                ):
+                    fail(i, 409, "Requested dates overlap another booking in this batch.")
+                    continue
+                if spend + it.coins_used > balance:
+                    fail(i, 400, "Insufficient coins")
+                    continue
+                spend += it.coins_used
+                accepted.append(i)
+
+            if all_or_nothing and len(accepted) < len(items):
+                raise _BatchAborted()
+
+            if accepted:
+                rows = await statements.fetch_all(
+                    BATCH_INSERT,
+                    username,
+                    [items[i].vehicle_id for i in accepted],
+                    [items[i].start_date for i in accepted],
+                    [items[i].end_date for i in accepted],
+                    [items[i].coins_used for i in accepted],
                 )
+                # map RETURNING rows back to items without relying on row order
+                by_key: Dict[tuple, List[dict]] = {}
+                for r in rows:
+                    key = (r["vehicle_id"], r["start_date"], r["end_date"], r["coins_used"])
+                    by_key.setdefault(key, []).append(dict(r))
+                for i in accepted:
+                    it = items[i]
+                    key = (it.vehicle_id, it.start_date.isoformat(), it.end_date.isoformat(), it.coins_used)
+                    booking = by_key[key].pop()
+                    booked.append(booking)
+                    results[i] = {"index": i, "ok": True, "status": 200, "booking": booking}
 
-            return {"booking": dict(booking)}
+                if spend > 0:
+                    balance_after = await statements.fetch_val(DEBIT_BALANCE, spend, username)
+                    running = balance
+                    changes, refs, afters = [], [], []
+                    for i in accepted:
+                        coins = items[i].coins_used
+                        if coins > 0:
+                            running -= coins
+                            changes.append(-coins)
+                            refs.append(str(results[i]["booking"]["id"]))
+                            afters.append(running)
+                    await statements.execute(BATCH_LEDGER, username, changes, refs, afters)
+            if balance_after is None:
+                balance_after = balance
 
+    except _BatchAborted:
+        first = next(r for r in results if r and not r["ok"])
+        for i, r in enumerate(results):
+            if r is None:
+                fail(i, 424, "Not booked: another item in the batch failed.")
+        return JSONResponse(
+            {"ok": False, "mode": body.mode, "booked": 0, "results": results},
+            status_code=first["status"],
+        )
+    except asyncpg.exceptions.ExclusionViolationError:
+        raise HTTPException(409, "A concurrent booking took one of the requested ranges; batch rolled back.")
     except HTTPException:
         raise
     except Exception as e:
-        log.exception("create_booking failed")
-        raise HTTPException(500, f"create_booking error: {e}")
+        log.exception("create_bookings_batch failed")
+        raise HTTPException(500, f"create_bookings_batch error: {e}")
 
-@router.get("/bookings/mine")
-async def get_my_bookings(username: str):
+    if booked:
+        outbox.notify()
+        await _bookings_changed({b["vehicle_id"] for b in booked}, username)
+    await balance_cache.written(username, balance_after)
+    return {
+        "ok": len(booked) == len(items),
+        "mode": body.mode,
+        "booked": len(booked),
+        "coin_balance": balance_after,
+        "results": results,
+    }
+
+@router.get("/bookings/mine", response_class=RecordsJSONResponse)
+async def get_my_bookings(
+    username: str,
+    status: Optional[Literal["ongoing", "upcoming", "completed"]] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    session_username: Optional[str] = Depends(session_user),
+):
     """
-    Return all bookings for the given user,
+    Return the user's bookings, newest first,
     including joined vehicle details.
+    Optionally only one status; the next page's cursor
+    comes back in X-Next-Cursor.
     """
-    rows = await database.fetch_all(
-        """
-        SELECT 
-            b.id,
-            b.vehicle_id,
-            v.brand,
-            v.model,
-            v.image_url,
-            b.start_date::text AS start_date,
-            b.end_date::text AS end_date,
-            CASE 
-                WHEN CURRENT_DATE BETWEEN b.start_date AND b.end_date THEN 'ongoing'
-                WHEN CURRENT_DATE < b.start_date THEN 'upcoming'
-                ELSE 'completed'
-            END AS status
-        FROM public.bookings b
-        JOIN public.vehicles v ON v.id = b.vehicle_id
-        WHERE b.username = :username
-        ORDER BY b.start_date DESC
-        """,
-        {"username": username},
-    )
+    authorize(session_username, username)
+    after = None
+    if cursor:
+        start, last_id = decode_cursor(cursor, 2)
+        if not is_cursor_int(last_id):
+            raise HTTPException(400, "Invalid cursor")
+        try:
+            after = (date.fromisoformat(start), last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(400, "Invalid cursor")
+
+    async def load():
+        if after:
+            rows = await statements.fetch_all(MY_BOOKINGS[(status, True)], username, limit + 1, *after)
+        else:
+            rows = await statements.fetch_all(MY_BOOKINGS[(status, False)], username, limit + 1)
+        return rows, split_page(rows, limit, lambda r: [r["start_date"], r["id"]])
+
+    key = (username, _mine_generation.get(username) or 0, status, after, limit)
+    rows, next_cursor = await _mine_cache.get_or_load(key, load)
 
     # Return empty list if no rows found
-    return [dict(r) for r in rows]
+    return RecordsJSONResponse(rows, headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
@@ -1,14 +1,27 @@
 # routes/coins.py
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Literal
+from datetime import date, datetime
 from database import database
+from statements import statements
+from balance_cache import balance_cache
+from events import CoinsChanged, outbox, payload_json
+from sessions import authorize, session_user
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, is_cursor_int, split_page
 import json
 import logging
+import os
 
 router = APIRouter(prefix="/coins", tags=["coins"])
 log = logging.getLogger(__name__)
 
+COIN_BATCH_MAX = int(os.environ.get("COIN_BATCH_MAX", 10_000))
+LEDGER_COLUMNS = [
+    "username", "change_amount", "reason", "reference_type",
+    "reference_id", "balance_after", "metadata",
+]
+
 class BalanceOut(BaseModel):
     username: str
     coin_balance: int
@@ -21,54 +34,204 @@ class CoinChangeIn(BaseModel):
     reference_id: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
 
-async def _ensure_user(username: str):
-    row = await database.fetch_one(
-        "SELECT username, coin_balance FROM public.users WHERE username = :u",
-        {"u": username},
+class CoinBatchIn(BaseModel):
+    items: List[CoinChangeIn] = Field(..., min_length=1, max_length=COIN_BATCH_MAX)
+
+class CoinBatchOut(BaseModel):
+    balances: List[BalanceOut]
+    applied: int
+    rejected: List[Dict[str, Any]]
+
+class LedgerEntryOut(BaseModel):
+    id: int
+    change_amount: int
+    reason: str
+    reference_type: Optional[str] = None
+    reference_id: Optional[str] = None
+    balance_after: Optional[int] = None
+    metadata: Optional[Any] = None
+    created_at: datetime
+
+class SummaryBucketOut(BaseModel):
+    bucket: date
+    reason: str
+    credits: int
+    debits: int
+    net: int
+    entries: int
+
+# ---- Hot statements (see statements.py) ----
+CREDIT = statements.register(
+    "coins.credit",
+    """
+    UPDATE public.users
+    SET coin_balance = coin_balance + $2
+    WHERE username = $1
+    RETURNING coin_balance
+    """,
+)
+# if balance is insufficient, this returns no row
+DEBIT = statements.register(
+    "coins.debit",
+    """
+    UPDATE public.users
+    SET coin_balance = coin_balance - $2
+    WHERE username = $1 AND coin_balance >= $2
+    RETURNING coin_balance
+    """,
+)
+# ledger row plus its CoinsChanged event for the outbox (events.py)
+INSERT_LEDGER = statements.register(
+    "coins.insert_ledger",
+    """
+    WITH ledger AS (
+      INSERT INTO public.coin_transactions
+        (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
+      VALUES
+        ($1, $2, $3, $4, $5, $6, $7)
+      RETURNING username, change_amount, reason, reference_type, reference_id, balance_after
     )
-    if not row:
+    INSERT INTO public.event_outbox (topic, payload)
+    SELECT 'CoinsChanged', to_jsonb(ledger) FROM ledger
+    """,
+)
+
+# ---- Batch statements ----
+# row locks in username order so concurrent batches can't deadlock
+LOCK_USERS = statements.register(
+    "coins.batch.lock_users",
+    """
+    SELECT username, coin_balance
+    FROM public.users
+    WHERE username = ANY($1::text[])
+    ORDER BY username
+    FOR UPDATE
+    """,
+)
+APPLY_DELTAS = statements.register(
+    "coins.batch.apply_deltas",
+    """
+    UPDATE public.users AS u
+    SET coin_balance = u.coin_balance + d.delta
+    FROM unnest($1::text[], $2::int[]) AS d(username, delta)
+    WHERE u.username = d.username
+      AND u.coin_balance + d.delta >= 0
+    RETURNING u.username, u.coin_balance
+    """,
+)
+
+# ---- Ledger reads ----
+# newest first; keyset on (created_at, id) over coin_transactions_user_time_idx
+_HISTORY_SELECT = """
+    SELECT id, change_amount, reason, reference_type, reference_id,
+           balance_after, metadata::text AS metadata, created_at
+    FROM public.coin_transactions
+    WHERE username = $1 {after}
+    ORDER BY created_at DESC, id DESC
+    LIMIT $2
+"""
+HISTORY_FIRST = statements.register(
+    "coins.history.first", _HISTORY_SELECT.format(after=""),
+)
+HISTORY_AFTER = statements.register(
+    "coins.history.after", _HISTORY_SELECT.format(after="AND (created_at, id) < ($3, $4)"),
+)
+# reads the coin_ledger_daily rollup (schema.py), never the raw ledger
+SUMMARY = statements.register(
+    "coins.summary",
+    """
+    SELECT date_trunc($2::text, day::timestamp)::date AS bucket, reason,
+           SUM(credits)::bigint AS credits,
+           SUM(debits)::bigint  AS debits,
+           SUM(entries)::bigint AS entries
+    FROM public.coin_ledger_daily
+    WHERE username = $1
+      AND ($3::date IS NULL OR day >= $3::date)
+      AND ($4::date IS NULL OR day <= $4::date)
+    GROUP BY 1, 2
+    ORDER BY 1 DESC, 2
+    """,
+)
+
+async def _ensure_user(username: str) -> int:
+    """The user's balance (read through balance_cache); 404 if unknown."""
+    balance = await balance_cache.get_balance(username)
+    if balance is None:
         raise HTTPException(404, f"User '{username}' not found")
-    return dict(row)
+    return balance
 
 @router.get("/balance", response_model=BalanceOut)
-async def get_balance(username: str = Query(..., min_length=1)):
-    user = await _ensure_user(username)
-    return {"username": user["username"], "coin_balance": user["coin_balance"]}
+async def get_balance(
+    username: str = Query(..., min_length=1),
+    session_username: Optional[str] = Depends(session_user),
+):
+    authorize(session_username, username)
+    return {"username": username, "coin_balance": await _ensure_user(username)}
+
+@router.get("/history", response_model=List[LedgerEntryOut])
+async def get_history(
+    response: Response,
+    username: str = Query(..., min_length=1),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session_username: Optional[str] = Depends(session_user),
+):
+    """A user's ledger, newest first; the next page's cursor is in X-Next-Cursor."""
+    authorize(session_username, username)
+    await _ensure_user(username)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        if not is_cursor_int(last_id):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        rows = await statements.fetch_all(HISTORY_AFTER, username, limit + 1, created_at, last_id)
+    else:
+        rows = await statements.fetch_all(HISTORY_FIRST, username, limit + 1)
+
+    next_cursor = split_page(rows, limit, lambda r: [r["created_at"].isoformat(), r["id"]])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [
+        {**dict(r), "metadata": json.loads(r["metadata"]) if r["metadata"] is not None else None}
+        for r in rows
+    ]
+
+@router.get("/summary", response_model=List[SummaryBucketOut])
+async def get_summary(
+    username: str = Query(..., min_length=1),
+    bucket: Literal["day", "week", "month"] = "day",
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    session_username: Optional[str] = Depends(session_user),
+):
+    """
+    Credits/debits per bucket (UTC days, ISO weeks, months) and reason, newest
+    first. Served from the daily rollup, so cost doesn't grow with the ledger.
+    """
+    authorize(session_username, username)
+    await _ensure_user(username)
+    rows = await statements.fetch_all(SUMMARY, username, bucket, from_date, to_date)
+    return [{**dict(r), "net": r["credits"] - r["debits"]} for r in rows]
 
 @router.post("/add", response_model=BalanceOut)
 async def add_coins(body: CoinChangeIn):
     await _ensure_user(body.username)
     try:
         async with database.transaction():
-            after_balance = await database.fetch_val(
-                """
-                UPDATE public.users
-                SET coin_balance = coin_balance + :amount
-                WHERE username = :u
-                RETURNING coin_balance
-                """,
-                {"u": body.username, "amount": body.amount},
-            )
+            after_balance = await statements.fetch_val(CREDIT, body.username, body.amount)
 
             meta_param = json.dumps(body.metadata) if body.metadata is not None else None
 
-            await database.execute(
-                """
-                INSERT INTO public.coin_transactions
-                  (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
-                VALUES
-                  (:a_u, :b_chg, :c_reason, :d_rtype, :e_rid, :f_after, :g_meta)
-                """,
-                {
-                    "a_u": body.username,
-                    "b_chg": body.amount,
-                    "c_reason": body.reason,
-                    "d_rtype": body.reference_type,
-                    "e_rid": body.reference_id,
-                    "f_after": after_balance,
-                    "g_meta": meta_param,
-                },
+            await statements.execute(
+                INSERT_LEDGER,
+                body.username, body.amount, body.reason,
+                body.reference_type, body.reference_id, after_balance, meta_param,
             )
+        outbox.notify()
+        await balance_cache.written(body.username, after_balance)
         return {"username": body.username, "coin_balance": after_balance}
     except Exception as e:
         log.exception("coins/add failed")
@@ -76,51 +239,35 @@ async def add_coins(body: CoinChangeIn):
 
 
 @router.post("/spend", response_model=BalanceOut)
-async def spend_coins(body: CoinChangeIn):
+async def spend_coins(body: CoinChangeIn, session_username: Optional[str] = Depends(session_user)):
     """
     Deduct coins from a user (if they have enough) and append a ledger row.
-    - Uses alphabetical placeholder names to keep parameter order aligned
-      with column order (databases/asyncpg quirk).
     - Serializes metadata to JSON text for safety.
     """
+    authorize(session_username, body.username)
     await _ensure_user(body.username)
 
     try:
         async with database.transaction():
             # 1) Try to deduct; if balance is insufficient, this returns NULL
-            after_balance = await database.fetch_val(
-                """
-                UPDATE public.users
-                SET coin_balance = coin_balance - :amount
-                WHERE username = :u AND coin_balance >= :amount
-                RETURNING coin_balance
-                """,
-                {"u": body.username, "amount": body.amount},
-            )
+            after_balance = await statements.fetch_val(DEBIT, body.username, body.amount)
             if after_balance is None:
+                # the cached balance may have been too optimistic (other worker)
+                await balance_cache.invalidate(body.username)
                 raise HTTPException(status_code=400, detail="Insufficient coins")
 
-            # 2) Insert ledger row (placeholder names a_..g_ match column order)
+            # 2) Insert ledger row
             meta_param = json.dumps(body.metadata) if body.metadata is not None else None
 
-            await database.execute(
-                """
-                INSERT INTO public.coin_transactions
-                  (username, change_amount, reason, reference_type, reference_id, balance_after, metadata)
-                VALUES
-                  (:a_u, :b_chg, :c_reason, :d_rtype, :e_rid, :f_after, :g_meta)
-                """,
-                {
-                    "a_u": body.username,
-                    "b_chg": -body.amount,        # negative for spend
-                    "c_reason": body.reason,
-                    "d_rtype": body.reference_type,
-                    "e_rid": body.reference_id,
-                    "f_after": after_balance,
-                    "g_meta": meta_param,
-                },
+            await statements.execute(
+                INSERT_LEDGER,
+                body.username, -body.amount,        # negative for spend
+                body.reason, body.reference_type, body.reference_id,
+                after_balance, meta_param,
             )
 
+        outbox.notify()
+        await balance_cache.written(body.username, after_balance)
         return {"username": body.username, "coin_balance": after_balance}
 
     except HTTPException:
@@ -128,3 +275,93 @@ async def spend_coins(body: CoinChangeIn):
     except Exception as e:
         log.exception("coins/spend failed")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _apply_batch(items: List[CoinChangeIn], sign: int) -> dict:
+    """
+    Apply many coin changes in one transaction: lock the users, one
+    UPDATE ... FROM unnest(...) for all balances, one COPY for the ledger.
+    A user whose spends don't fit their balance gets none of them applied,
+    so a balance never goes negative.
+    """
+    totals: Dict[str, int] = {}
+    for it in items:
+        totals[it.username] = totals.get(it.username, 0) + sign * it.amount
+
+    rejected: List[Dict[str, Any]] = []
+    async with database.transaction():
+        current = {
+            r["username"]: r["coin_balance"]
+            for r in await statements.fetch_all(LOCK_USERS, sorted(totals))
+        }
+        accepted: Dict[str, int] = {}
+        for username, delta in totals.items():
+            if username not in current:
+                rejected.append({"username": username, "status": 404, "detail": f"User '{username}' not found"})
+            elif current[username] + delta < 0:
+                rejected.append({"username": username, "status": 400, "detail": "Insufficient coins"})
+            else:
+                accepted[username] = delta
+
+        balances: Dict[str, int] = {}
+        if accepted:
+            rows = await statements.fetch_all(APPLY_DELTAS, list(accepted), list(accepted.values()))
+            balances = {r["username"]: r["coin_balance"] for r in rows}
+
+            # ledger rows in request order, each with its running balance_after
+            running = {u: balances[u] - accepted[u] for u in accepted}
+            records, events = [], []
+            for it in items:
+                if it.username not in accepted:
+                    continue
+                running[it.username] += sign * it.amount
+                records.append((
+                    it.username, sign * it.amount, it.reason, it.reference_type, it.reference_id,
+                    running[it.username],
+                    json.dumps(it.metadata) if it.metadata is not None else None,
+                ))
+                events.append((CoinsChanged.topic, payload_json(CoinsChanged(*records[-1][:6]))))
+            async with statements.connection() as raw:
+                await raw.copy_records_to_table(
+                    "coin_transactions", schema_name="public",
+                    columns=LEDGER_COLUMNS, records=records,
+                )
+                await raw.copy_records_to_table(
+                    "event_outbox", schema_name="public",
+                    columns=("topic", "payload"), records=events,
+                )
+
+    if balances:
+        outbox.notify()
+    for username, balance in balances.items():
+        await balance_cache.written(username, balance)
+    return {
+        "balances": [{"username": u, "coin_balance": b} for u, b in balances.items()],
+        "applied": sum(1 for it in items if it.username in balances),
+        "rejected": rejected,
+    }
+
+
+@router.post("/add/batch", response_model=CoinBatchOut)
+async def add_coins_batch(body: CoinBatchIn):
+    """Credit many users at once (reward campaigns); returns resulting balances."""
+    try:
+        return await _apply_batch(body.items, +1)
+    except Exception as e:
+        log.exception("coins/add/batch failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/spend/batch", response_model=CoinBatchOut)
+async def spend_coins_batch(body: CoinBatchIn, session_username: Optional[str] = Depends(session_user)):
+    """
+    Debit many users at once; users without enough coins are rejected as a
+    whole. With a session every item must be the session's own user.
+    """
+    for username in {it.username for it in body.items}:
+        authorize(session_username, username)
+    try:
+        return await _apply_batch(body.items, -1)
+    except Exception as e:
+        log.exception("coins/spend/batch failed")
+        raise HTTPException(status_code=500, detail=str(e))
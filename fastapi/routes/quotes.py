@@ -0,0 +1,53 @@
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import date
+from pricing import pricing
+import os
+
+router = APIRouter(prefix="", tags=["pricing"])
+
+QUOTE_BATCH_MAX = int(os.environ.get("QUOTE_BATCH_MAX", 1000))
+
+class QuoteItem(BaseModel):
+    vehicle_id: int
+    start_date: date
+    end_date: date
+
+class QuoteBatchBody(BaseModel):
+    items: List[QuoteItem] = Field(..., min_length=1, max_length=QUOTE_BATCH_MAX)
+
+@router.get("/quote")
+async def get_quote(
+    vehicle_id: int,
+    start_date: date,
+    end_date: Optional[date] = Query(None),
+):
+    """
+    Coin price of booking the vehicle for these dates: send `coins` as
+    coins_used and `quote_token` with POST /bookings to be held to it.
+    """
+    end_date = end_date or start_date
+    if end_date < start_date:
+        raise HTTPException(422, "end_date must be on/after start_date.")
+    quote = await pricing.quote(vehicle_id, start_date, end_date)
+    if quote is None:
+        raise HTTPException(404, f"Vehicle {vehicle_id} not found.")
+    return quote
+
+@router.post("/quote/batch")
+async def quote_batch(body: QuoteBatchBody):
+    """
+    Quotes for many vehicle/date ranges at once (search results), in request
+    order; an item whose vehicle doesn't exist gets an "error" instead.
+    """
+    for i, it in enumerate(body.items):
+        if it.end_date < it.start_date:
+            raise HTTPException(422, f"items[{i}]: end_date must be on/after start_date.")
+    quotes = await pricing.quote_many((it.vehicle_id, it.start_date, it.end_date) for it in body.items)
+    return {
+        "quotes": [
+            q if q is not None else {"vehicle_id": it.vehicle_id, "error": "Vehicle not found"}
+            for it, q in zip(body.items, quotes)
+        ]
+    }
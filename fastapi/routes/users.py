@@ -1,7 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional, List
 from database import database
+from statements import statements
+from balance_cache import balance_cache
+from response_cache import vehicle_responses
+import occupancy
+from passwords import passwords
+from sessions import bearer_scheme, sessions
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, ndjson_response, split_page
+from record_json import RecordsJSONResponse
 
 router = APIRouter(tags=["users"])
 
@@ -28,6 +37,26 @@ class ForgotPasswordIn(BaseModel):
     newPassword: str
 
 
+# ---- Hot statements (see statements.py) ----
+PASSWORD_OF = statements.register(
+    "users.password_of",
+    "SELECT password FROM public.users WHERE username = $1",
+)
+# compare-and-set, so a password reset racing the login's upgrade wins
+UPGRADE_PASSWORD = statements.register(
+    "users.upgrade_password",
+    "UPDATE public.users SET password = $3 WHERE username = $1 AND password = $2",
+)
+PROFILE = statements.register(
+    "users.profile",
+    """
+    SELECT username, NULL::text AS email, COALESCE(description,'') AS description
+    FROM public.users
+    WHERE username = $1
+    """,
+)
+
+
 # ---- Register ----
 @router.post("/register/", response_model=UserOut)
 async def register(user: UserCreate):
@@ -39,7 +68,7 @@ async def register(user: UserCreate):
     try:
         await database.execute(query, {
             "username": user.username,
-            "password": user.password,           # NOTE: plaintext; consider hashing later
+            "password": await passwords.hash(user.password),
             "description": user.description or ""
         })
         return {"username": user.username}
@@ -50,13 +79,31 @@ async def register(user: UserCreate):
 # ---- Login ----
 @router.post("/login/")
 async def login(user: UserCreate):
-    query = "SELECT password FROM public.users WHERE username = :username"
-    result = await database.fetch_one(query, {"username": user.username})
+    result = await statements.fetch_one(PASSWORD_OF, user.username)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
-    if result["password"] != user.password:
+    ok, needs_rehash = await passwords.verify(user.password, result["password"])
+    if not ok:
         raise HTTPException(status_code=401, detail="Incorrect password")
-    return {"message": "Login successful"}
+    if needs_rehash:
+        # legacy plaintext row or an older cost setting
+        new_hash = await passwords.hash(user.password)
+        await statements.execute(UPGRADE_PASSWORD, user.username, result["password"], new_hash)
+    # send back as "Authorization: Bearer <token>"; see sessions.py
+    return {
+        "message": "Login successful",
+        "username": user.username,
+        "token_type": "bearer",
+        **sessions.issue(user.username),
+    }
+
+
+# ---- Logout ----
+@router.post("/logout/")
+async def logout(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
+    if credentials is not None:
+        sessions.revoke(credentials.credentials)
+    return {"message": "Logged out"}
 
 
 # ---- Forgot / Reset Password ----
@@ -74,29 +121,41 @@ async def forgot_password(data: ForgotPasswordIn):
         SET password = :newPassword 
         WHERE username = :username
     """
-    await database.execute(query_update, {"newPassword": data.newPassword, "username": data.username})
+    new_hash = await passwords.hash(data.newPassword)
+    await database.execute(query_update, {"newPassword": new_hash, "username": data.username})
+    sessions.revoke_user(data.username)
     return {"message": "Password updated successfully"}
 
 
 # ---- List all users (minimal) ----
-@router.get("/users/", response_model=List[UserOut])
-async def list_users():
-    query = "SELECT username FROM public.users ORDER BY username"
-    rows = await database.fetch_all(query)
-    return [{"username": r["username"]} for r in rows]
+@router.get("/users/", response_model=List[UserOut], response_class=RecordsJSONResponse)
+async def list_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    stream: bool = False,
+):
+    # keyset on username (unique); next page cursor comes back in X-Next-Cursor
+    params = {}
+    where_sql = ""
+    if cursor:
+        (params["after"],) = decode_cursor(cursor, 1)
+        if not isinstance(params["after"], str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        where_sql = "WHERE username > :after"
+    query = f"SELECT username FROM public.users {where_sql} ORDER BY username"
+
+    if stream:
+        return ndjson_response(database.iterate(query, params))
+
+    rows = await database.fetch_all(f"{query} LIMIT {limit + 1}", params)
+    next_cursor = split_page(rows, limit, lambda r: [r["username"]])
+    return RecordsJSONResponse(rows, headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
 
 
 # ---- Get one user (with description) ----
 @router.get("/users/{username}", response_model=UserProfile)
 async def get_user(username: str):
-    row = await database.fetch_one(
-        """
-        SELECT username, NULL::text AS email, COALESCE(description,'') AS description
-        FROM public.users
-        WHERE username = :u
-        """,
-        {"u": username},
-    )
+    row = await statements.fetch_one(PROFILE, username)
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     return dict(row)
@@ -129,6 +188,23 @@ async def patch_user(username: str, payload: UserUpdate):
 # ---- Delete user ----
 @router.delete("/users/{username}")
 async def delete_user(username: str):
-    query = "DELETE FROM public.users WHERE username = :username"
-    await database.execute(query, {"username": username})
+    # the user's bookings go with them: report which vehicles had any
+    rows = await database.fetch_all(
+        """
+        WITH booked AS (
+          SELECT DISTINCT vehicle_id FROM public.bookings WHERE username = :username
+        ),
+        gone AS (
+          DELETE FROM public.users WHERE username = :username
+        )
+        SELECT vehicle_id FROM booked
+        """,
+        {"username": username},
+    )
+    vehicle_ids = [r["vehicle_id"] for r in rows]
+    if vehicle_ids:
+        occupancy.bookings_changed(vehicle_ids)
+        await vehicle_responses.bump("bookings")
+    await balance_cache.invalidate(username)
+    sessions.revoke_user(username)
     return {"message": f"User {username} deleted"}
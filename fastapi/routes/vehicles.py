@@ -1,8 +1,25 @@
-from fastapi import APIRouter, Query, HTTPException, status
-from typing import Optional, List, Dict
+from fastapi import APIRouter, Query, HTTPException, Request, status
+from typing import Optional, List, Dict, Tuple, Any, AsyncIterator
 from database import database
+from statements import statements
+from cache import TTLCache
+from response_cache import vehicle_responses
+import occupancy
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, is_cursor_int, ndjson_response, split_page
+from record_json import RecordsJSONResponse
 from pydantic import BaseModel
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+import asyncpg
+import codecs
+import csv
+import json
+import os
+
+VEHICLE_SEARCH_CACHE_TTL = float(os.environ.get("VEHICLE_SEARCH_CACHE_TTL", 30))
+VEHICLE_IMPORT_BATCH = int(os.environ.get("VEHICLE_IMPORT_BATCH", 5000))
+# rejected rows are all counted, but only this many are described
+VEHICLE_IMPORT_ERRORS_MAX = 100
+OCCUPANCY_MAX_DAYS = int(os.environ.get("OCCUPANCY_MAX_DAYS", 366))
 
 router = APIRouter(prefix="", tags=["vehicles"])
 
@@ -30,24 +47,23 @@ class VehicleOut(BaseModel):
     coin_rate_per_day: Optional[int] = None
     image_url: Optional[str] = None
 
-@router.post("/vehicles", response_model=VehicleOut)
-async def create_vehicle(v: VehicleCreate):
-    import datetime
-    data = v.dict()
-
-    for key in ("rent_start_date", "rent_end_date"):
-        val = data.get(key)
-        if isinstance(val, str) and val:
-            try:
-                data[key] = datetime.date.fromisoformat(val)
-            except Exception:
-                data[key] = None
+async def _catalog_changed() -> None:
+    _search_cache.clear()
+    occupancy.fleet_changed()
+    await vehicle_responses.bump("catalog")
 
+def _apply_defaults(data: dict) -> dict:
     # Fallbacks if caller didn’t send capacity/rate
     if not data.get("capacity"):
         data["capacity"] = "5" if data.get("type_of_car") == "Car" else "2"
     if data.get("coin_rate_per_day") in (None, 0):
         data["coin_rate_per_day"] = 300 if data.get("type_of_car") == "Car" else 120
+    return data
+
+@router.post("/vehicles", response_model=VehicleOut)
+async def create_vehicle(v: VehicleCreate):
+    # pydantic already parsed the dates
+    data = _apply_defaults(v.dict())
 
     q = """
         INSERT INTO public.vehicles
@@ -63,45 +79,332 @@ async def create_vehicle(v: VehicleCreate):
     """
     try:
         row = await database.fetch_one(q, data)
-        return dict(row)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await _catalog_changed()
+    return dict(row)
 
-@router.get("/vehicles/{vehicle_id}", response_model=VehicleOut)
-async def get_vehicle(vehicle_id: int):
-    q = """
-      SELECT id, type_of_car, brand, model,
-             TO_CHAR(rent_start_date,'YYYY-MM-DD') AS rent_start_date,
-             TO_CHAR(rent_end_date,'YYYY-MM-DD')   AS rent_end_date,
-             capacity, coin_rate_per_day, image_url,
-             fuel_consumption, max_speed
-      FROM public.vehicles
-      WHERE id = :id
+# ---- Bulk import ----
+IMPORT_COLUMNS = [
+    "type_of_car", "brand", "model", "rent_start_date", "rent_end_date",
+    "capacity", "coin_rate_per_day", "image_url", "fuel_consumption", "max_speed",
+]
+# Created once per pooled connection; every batch commits on its own, which
+# empties it again.
+_IMPORT_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS vehicle_import (
+      type_of_car TEXT, brand TEXT, model TEXT,
+      rent_start_date DATE, rent_end_date DATE,
+      capacity TEXT, coin_rate_per_day INTEGER, image_url TEXT,
+      fuel_consumption TEXT, max_speed TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+_IMPORT_MERGE = f"""
+    INSERT INTO public.vehicles ({", ".join(IMPORT_COLUMNS)})
+    SELECT {", ".join(IMPORT_COLUMNS)} FROM vehicle_import
+"""
+# one row at a time, for a batch the database refused as a whole
+_IMPORT_ONE = f"""
+    INSERT INTO public.vehicles ({", ".join(IMPORT_COLUMNS)})
+    VALUES ({", ".join(f"${i}" for i in range(1, len(IMPORT_COLUMNS) + 1))})
+"""
+INT4_MAX = 2**31 - 1
+
+def _import_record(raw: Dict[str, Any]) -> tuple:
+    """
+    One input row -> COPY record, with create_vehicle's defaults; ValueError
+    for anything the database would refuse, so one bad row is one rejection.
     """
-    row = await database.fetch_one(q, {"id": vehicle_id})
-    if not row:
+    def text(key):
+        val = raw.get(key)
+        if isinstance(val, (dict, list)):
+            raise ValueError(f"{key} must be a scalar")
+        val = "" if val is None else str(val).strip()
+        if "\x00" in val:
+            # Postgres text can't hold NUL
+            raise ValueError(f"{key} contains a NUL character")
+        return val or None
+
+    data = {k: text(k) for k in IMPORT_COLUMNS}
+    for key in ("type_of_car", "brand", "model"):
+        if not data[key]:
+            raise ValueError(f"{key} is required")
+    for key in ("rent_start_date", "rent_end_date"):
+        if data[key]:
+            data[key] = date.fromisoformat(data[key])
+    if data["rent_start_date"] and data["rent_end_date"] and data["rent_end_date"] < data["rent_start_date"]:
+        raise ValueError("rent_end_date is before rent_start_date")
+    if data["coin_rate_per_day"]:
+        data["coin_rate_per_day"] = int(data["coin_rate_per_day"])
+        if not 0 <= data["coin_rate_per_day"] <= INT4_MAX:
+            raise ValueError(f"coin_rate_per_day must be between 0 and {INT4_MAX}")
+    _apply_defaults(data)
+    return tuple(data[k] for k in IMPORT_COLUMNS)
+
+async def _body_lines(request: Request) -> AsyncIterator[str]:
+    """The request body as text lines, decoded incrementally (no full buffering)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+async def _import_rows(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """(line number, dict or ValueError) per non-blank record."""
+    header: Optional[List[str]] = None
+    line_no = 0
+    async for line in _body_lines(request):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                yield line_no, ValueError(f"invalid JSON: {e}")
+                continue
+            yield line_no, row
+        else:
+            # one record per line: quoted fields can't contain newlines
+            fields = next(csv.reader([line]))
+            if header is None:
+                header = [h.strip() for h in fields]
+                missing = {"type_of_car", "brand", "model"} - set(header)
+                if missing:
+                    raise HTTPException(422, f"CSV header is missing {sorted(missing)}")
+                continue
+            if len(fields) != len(header):
+                yield line_no, ValueError(f"expected {len(header)} fields, got {len(fields)}")
+                continue
+            yield line_no, dict(zip(header, fields))
+
+@router.post("/vehicles/import")
+async def import_vehicles(
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+):
+    """
+    Bulk-create vehicles from a streamed CSV (with a header row) or NDJSON
+    body; the format comes from `format` or the Content-Type. Rows get the
+    same capacity/coin_rate_per_day defaults as POST /vehicles. Valid rows
+    are COPYed into a temp staging table and merged into public.vehicles
+    one batch at a time, each batch in its own short transaction on a
+    connection borrowed for just that batch, so memory stays flat and a
+    slow upload holds no connection between batches. Invalid rows are
+    skipped and reported; if the database still refuses a batch, its rows
+    are retried one by one and only the refused ones count as rejected.
+    """
+    fmt = fmt or ("ndjson" if "json" in request.headers.get("content-type", "") else "csv")
+    inserted = rejected = 0
+    errors: List[Dict[str, Any]] = []
+    batch: List[tuple] = []
+    batch_lines: List[int] = []
+
+    def reject(line_no: int, detail: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < VEHICLE_IMPORT_ERRORS_MAX:
+            errors.append({"line": line_no, "detail": detail})
+
+    async def flush():
+        nonlocal inserted
+        async with statements.connection() as raw:
+            await raw.execute(_IMPORT_STAGING)
+            try:
+                async with raw.transaction():
+                    await raw.copy_records_to_table("vehicle_import", columns=IMPORT_COLUMNS, records=batch)
+                    status_line = await raw.execute(_IMPORT_MERGE)
+                inserted += int(status_line.rsplit(" ", 1)[-1])
+            except asyncpg.PostgresError:
+                for line_no, record in zip(batch_lines, batch):
+                    try:
+                        await raw.execute(_IMPORT_ONE, *record)
+                        inserted += 1
+                    except asyncpg.PostgresError as e:
+                        reject(line_no, str(e))
+        batch.clear()
+        batch_lines.clear()
+
+    try:
+        async for line_no, row in _import_rows(request, fmt):
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                batch.append(_import_record(row))
+                batch_lines.append(line_no)
+            except ValueError as e:
+                reject(line_no, str(e))
+                continue
+            if len(batch) >= VEHICLE_IMPORT_BATCH:
+                await flush()
+        if batch:
+            await flush()
+    except HTTPException:
+        raise
+    except Exception as e:
+        # earlier batches are committed and stay
+        raise HTTPException(status_code=400, detail=f"import stopped after {inserted} rows were inserted: {e}")
+    finally:
+        if inserted:
+            await _catalog_changed()
+    return {"format": fmt, "inserted": inserted, "rejected": rejected, "errors": errors}
+
+# ---- Search (declared before /vehicles/{vehicle_id} so "search" isn't an id) ----
+# Keep in sync with the vehicles_search_trgm expression index in schema.py.
+SEARCH_DOC = "lower(v.type_of_car || ' ' || v.brand || ' ' || v.model)"
+# $1 query, $2 '%q%', $3 'q%', $4 '% q%', $5 type_of_car or NULL, $6 limit, $7 offset.
+# Rank: whole-text prefix > word prefix > substring, then trigram word
+# similarity, which also lets typos through ($1 <% doc).
+VEHICLE_SEARCH = statements.register(
+    "vehicles.search",
+    f"""
+    SELECT id, type_of_car, brand, model,
+           TO_CHAR(rent_start_date,'YYYY-MM-DD') AS rent_start_date,
+           TO_CHAR(rent_end_date,'YYYY-MM-DD')   AS rent_end_date,
+           capacity, coin_rate_per_day, image_url,
+           rank
+    FROM (
+      SELECT v.*,
+             (CASE WHEN {SEARCH_DOC} LIKE $3 THEN 2
+                   WHEN {SEARCH_DOC} LIKE $4 THEN 1
+                   ELSE 0 END
+              + word_similarity($1, {SEARCH_DOC}))::float8 AS rank
+      FROM public.vehicles v
+      WHERE ({SEARCH_DOC} LIKE $2 OR $1 <% {SEARCH_DOC})
+        AND ($5::text IS NULL OR v.type_of_car = $5::text)
+    ) v
+    ORDER BY rank DESC, brand, model, id
+    LIMIT $6 OFFSET $7
+    """,
+)
+_search_cache = TTLCache("vehicle_search", maxsize=2048, ttl=VEHICLE_SEARCH_CACHE_TTL)
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@router.get("/vehicles/search", response_model=List[Dict], response_class=RecordsJSONResponse)
+async def search_vehicles(
+    q: str = Query(..., min_length=1, max_length=100),
+    type_of_car: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Search-as-you-type over type/brand/model: prefix and substring matches
+    plus trigram fuzzy matching, best first. The next page's cursor comes
+    back in X-Next-Cursor. Hot queries are served from an in-process LRU.
+    """
+    term = " ".join(q.lower().split())
+    if not term:
+        raise HTTPException(status_code=422, detail="q must not be blank")
+    offset = decode_cursor(cursor, 1)[0] if cursor else 0
+    if not is_cursor_int(offset) or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def load():
+        esc = _like_escape(term)
+        rows = await statements.fetch_all(
+            VEHICLE_SEARCH,
+            term, f"%{esc}%", f"{esc}%", f"% {esc}%", type_of_car, limit + 1, offset,
+        )
+        return rows
+
+    rows = await _search_cache.get_or_load((term, type_of_car, limit, offset), load)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor([offset + limit])
+    return RecordsJSONResponse(rows, headers=headers)
+
+# ---- Calendars (also declared before /vehicles/{vehicle_id}) ----
+def _window(from_date: Optional[date], to_date: Optional[date], default_days: int) -> Tuple[date, date]:
+    start = from_date or date.today()
+    end = to_date or start + timedelta(days=default_days - 1)
+    if end < start:
+        raise HTTPException(status_code=422, detail="to must be on/after from.")
+    if (end - start).days >= OCCUPANCY_MAX_DAYS:
+        raise HTTPException(status_code=422, detail=f"window is limited to {OCCUPANCY_MAX_DAYS} days.")
+    return start, end
+
+@router.get("/vehicles/availability")
+async def fleet_availability(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    type_of_car: Optional[str] = None,
+):
+    """Per day: vehicles offered (inside their rent window), booked and free. Default: this month."""
+    if from_date is None and to_date is None:
+        today = date.today()
+        from_date = today.replace(day=1)
+        to_date = (from_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    start, end = _window(from_date, to_date, 31)
+    return await occupancy.fleet_availability(start, end, type_of_car)
+
+@router.get("/vehicles/{vehicle_id}/calendar")
+async def vehicle_calendar(
+    vehicle_id: int,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+):
+    """Free / booked / unavailable intervals of one vehicle. Default: the next 90 days."""
+    start, end = _window(from_date, to_date, 90)
+    calendar = await occupancy.vehicle_calendar(vehicle_id, start, end)
+    if calendar is None:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    return dict(row)
+    return calendar
 
-@router.get("/vehicles", response_model=List[Dict])
-async def list_vehicles(
+VEHICLE_DETAIL = statements.register(
+    "vehicles.detail",
+    """
+    SELECT id, type_of_car, brand, model,
+           TO_CHAR(rent_start_date,'YYYY-MM-DD') AS rent_start_date,
+           TO_CHAR(rent_end_date,'YYYY-MM-DD')   AS rent_end_date,
+           capacity, coin_rate_per_day, image_url,
+           fuel_consumption, max_speed
+    FROM public.vehicles
+    WHERE id = $1
+    """,
+)
+
+@router.get("/vehicles/{vehicle_id}", response_model=VehicleOut)
+async def get_vehicle(request: Request, vehicle_id: int):
+    """Served from the response cache; honours If-None-Match (304)."""
+    async def load():
+        row = await statements.fetch_one(VEHICLE_DETAIL, vehicle_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
+        return dict(row), {}
+
+    return await vehicle_responses.respond(request, ("detail", vehicle_id), ("catalog",), load)
+
+def _parse_date(s: Optional[str]) -> Optional[date]:
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date() if s else None
+    except Exception:
+        return None
+
+def build_list_query(
     type_of_car: Optional[str] = None,
     brand: Optional[str] = None,
     model: Optional[str] = None,
-    from_date: Optional[str] = None,
-    to_date: Optional[str] = None,
+    v_from: Optional[date] = None,
+    v_to: Optional[date] = None,
     exclude_booked: bool = True,
     viewer_username: Optional[str] = None,
-):
-    def parse_date(s: Optional[str]) -> Optional[date]:
-        try:
-            return datetime.strptime(s, "%Y-%m-%d").date() if s else None
-        except Exception:
-            return None
-
-    v_from = parse_date(from_date)
-    v_to   = parse_date(to_date)
-
+    after: Optional[Tuple[Any, ...]] = None,
+    limit: Optional[int] = 500,
+) -> Tuple[str, Dict[str, object]]:
+    """
+    SQL + params behind GET /vehicles (also used by bench/exclude_booked.py).
+    `after` is a decoded keyset cursor (see _sort_key); limit=None means no LIMIT.
+    """
     conditions: list[str] = []
     params: Dict[str, object] = {}
 
@@ -125,7 +428,38 @@ async def list_vehicles(
         conditions.append("v.rent_start_date <= :v_to")
         params["v_to"] = v_to
 
+    # hide vehicles booked in the window, except by the viewer themselves.
+    # Single anti-join; served by bookings_vehicle_period_gist (see schema.py).
+    if exclude_booked and (v_from or v_to):
+        viewer_clause = ""
+        if viewer_username:
+            viewer_clause = "AND b.username IS DISTINCT FROM :viewer"
+            params["viewer"] = viewer_username
+        conditions.append(f"""
+          NOT EXISTS (
+            SELECT 1
+            FROM public.bookings b
+            WHERE b.vehicle_id = v.id
+              AND daterange(b.start_date, b.end_date, '[]')
+                  && daterange(CAST(:b_from AS date), CAST(:b_to AS date), '[]')
+              {viewer_clause}
+          )
+        """)
+        params["b_from"], params["b_to"] = v_from or v_to, v_to or v_from
+
+    # keyset: strictly after the last row of the previous page
+    if after:
+        conditions.append("""
+          (v.type_of_car, v.brand, v.model,
+           COALESCE(v.rent_start_date::date, 'infinity'::date), v.id)
+          > (:c_type, :c_brand, :c_model,
+             COALESCE(CAST(:c_start AS date), 'infinity'::date), :c_id)
+        """)
+        c_type, c_brand, c_model, c_start, c_id = after
+        params.update(c_type=c_type, c_brand=c_brand, c_model=c_model, c_start=c_start, c_id=c_id)
+
     where_sql = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
 
     q = f"""
       SELECT v.id, v.type_of_car, v.brand, v.model,
@@ -134,9 +468,71 @@ async def list_vehicles(
              v.capacity, v.coin_rate_per_day, v.image_url
       FROM public.vehicles v
       {where_sql}
-      ORDER BY v.type_of_car, v.brand, v.model, v.rent_start_date NULLS LAST
-      LIMIT 500
+      ORDER BY v.type_of_car, v.brand, v.model,
+               COALESCE(v.rent_start_date::date, 'infinity'::date), v.id
+      {limit_sql}
+    """
+    return q, params
+
+def _list_cursor(cursor: str) -> tuple:
+    """The keyset of a GET /vehicles cursor, typed; 400 if it was tampered with."""
+    c_type, c_brand, c_model, c_start, c_id = decode_cursor(cursor, 5)
+    if not all(v is None or isinstance(v, str) for v in (c_type, c_brand, c_model, c_start)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not is_cursor_int(c_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        start = date.fromisoformat(c_start) if c_start is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return c_type, c_brand, c_model, start, c_id
+
+def _sort_key(row) -> List[Any]:
+    # mirrors the ORDER BY; a NULL rent_start_date sorts last, like 'infinity'
+    return [row["type_of_car"], row["brand"], row["model"], row["rent_start_date"], row["id"]]
+
+@router.get("/vehicles", response_model=List[Dict], response_class=RecordsJSONResponse)
+async def list_vehicles(
+    request: Request,
+    type_of_car: Optional[str] = None,
+    brand: Optional[str] = None,
+    model: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    exclude_booked: bool = True,
+    viewer_username: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=500),
+    stream: bool = False,
+):
     """
+    Paged by keyset: pass the X-Next-Cursor header of a page as `cursor` to get
+    the next one. stream=true returns every remaining row as NDJSON from a
+    server-side cursor instead (no page limit, flat memory).
+
+    Pages are served from the response cache (ETag / If-None-Match -> 304);
+    a page that hides booked vehicles also expires on booking writes.
+    """
+    after = _list_cursor(cursor) if cursor else None
+    v_from, v_to = _parse_date(from_date), _parse_date(to_date)
+    q, params = build_list_query(
+        type_of_car, brand, model, v_from, v_to,
+        exclude_booked, viewer_username,
+        after=after, limit=None if stream else limit + 1,
+    )
+    if stream:
+        return ndjson_response(database.iterate(q, params))
+
+    async def load():
+        rows = await database.fetch_all(q, params)
+        next_cursor = split_page(rows, limit, _sort_key)
+        return rows, ({NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {})
 
-    rows = await database.fetch_all(q, params)
-    return [dict(r) for r in rows]
+    uses_bookings = exclude_booked and bool(v_from or v_to)
+    key = ("list", type_of_car, brand, model, v_from, v_to, uses_bookings, viewer_username, cursor, limit)
+    return await vehicle_responses.respond(
+        request, key,
+        ("catalog", "bookings") if uses_bookings else ("catalog",),
+        load,
+        private=viewer_username is not None,
+    )
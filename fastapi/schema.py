@@ -0,0 +1,262 @@
+"""
+Idempotent schema additions (extensions, indexes) applied at startup.
+
+The base tables are created outside this app, so everything here must be
+safe to run on every boot and from several workers at once: statements use
+IF NOT EXISTS and run under a session advisory lock.
+"""
+from typing import List
+import logging
+
+from database import database
+
+log = logging.getLogger(__name__)
+
+# arbitrary constant shared by every worker of this app
+SCHEMA_LOCK_KEY = 7_342_001
+
+# bookings whose BookingCreated event is still in the outbox are left out:
+# the outbox worker (events.py) counts them when it drains
+_COUNTERS_BACKFILL = """
+    WITH booked AS (
+      SELECT coins_used
+      FROM public.bookings
+      WHERE id NOT IN (
+        SELECT (payload->>'booking_id')::int FROM public.event_outbox WHERE topic = 'BookingCreated'
+      )
+    )
+    INSERT INTO public.metric_counters (name, shard, value)
+    SELECT c.name, 0, c.value
+    FROM (
+      SELECT 'users' AS name, (SELECT COUNT(*) FROM public.users) AS value
+      UNION ALL SELECT 'vehicles', (SELECT COUNT(*) FROM public.vehicles)
+      UNION ALL SELECT 'rentals',  (SELECT COUNT(*) FROM booked)
+      UNION ALL SELECT 'spending', (SELECT COALESCE(SUM(coins_used), 0) FROM booked)
+    ) c
+"""
+
+# ledger rows folded into per (user, UTC day, reason) totals for the one-time
+# backfill; afterwards the outbox worker adds each CoinsChanged event
+_LEDGER_ROLLUP_SELECT = """
+    SELECT username, (created_at AT TIME ZONE 'UTC')::date, reason,
+           SUM(GREATEST(change_amount, 0)), SUM(GREATEST(-change_amount, 0)), COUNT(*)
+    FROM {source}
+    GROUP BY 1, 2, 3
+"""
+
+STATEMENTS: List[str] = [
+    # btree_gist lets a GiST index mix the scalar vehicle_id with a daterange
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    # overlap lookups: vehicle_id = ? AND daterange(start, end) && daterange(?, ?)
+    """
+    CREATE INDEX IF NOT EXISTS bookings_vehicle_period_gist
+    ON public.bookings
+    USING gist (vehicle_id, daterange(start_date, end_date, '[]'))
+    """,
+    # Race-free bookings: two concurrent inserts for overlapping dates of one
+    # vehicle by different users can't both commit (23P01 -> HTTP 409).
+    # Same-user overlaps stay allowed, matching the default booking check.
+    # Fails (and is logged) if existing rows already overlap; deployments
+    # without it can set BOOKING_ADVISORY_LOCKS=1 instead.
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap') THEN
+        ALTER TABLE public.bookings
+          ADD CONSTRAINT bookings_no_overlap
+          EXCLUDE USING gist (
+            vehicle_id WITH =,
+            daterange(start_date, end_date, '[]') WITH &&,
+            username WITH <>
+          );
+      END IF;
+    END $$
+    """,
+    # GET /bookings/mine: a user's bookings newest first, keyset paged and
+    # filtered by status as start/end date ranges; INCLUDE lets the status
+    # filter run on the index before any heap access
+    """
+    CREATE INDEX IF NOT EXISTS bookings_user_start_idx
+    ON public.bookings (username, start_date DESC, id DESC)
+    INCLUDE (end_date, vehicle_id)
+    """,
+    # ongoing bookings: end_date >= today is a short range per user
+    """
+    CREATE INDEX IF NOT EXISTS bookings_user_end_idx
+    ON public.bookings (username, end_date)
+    """,
+    # "what is booked on day X" across all vehicles (/admin/metrics)
+    """
+    CREATE INDEX IF NOT EXISTS bookings_period_gist
+    ON public.bookings
+    USING gist (daterange(start_date, end_date, '[]'))
+    """,
+
+    # ---- Transactional outbox (events.py) ----
+    # written in the same transaction as the booking / coin change it
+    # describes; drained in id order by OutboxWorker
+    """
+    CREATE TABLE IF NOT EXISTS public.event_outbox (
+      id         BIGSERIAL   PRIMARY KEY,
+      topic      TEXT        NOT NULL,
+      payload    JSONB       NOT NULL,
+      created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+
+    # ---- Response cache versions (response_cache.py) ----
+    # one sequence per scope, shared by every worker; nextval never blocks
+    # and is not rolled back, so bumping one costs no lock
+    "CREATE SEQUENCE IF NOT EXISTS public.response_version_catalog",
+    "CREATE SEQUENCE IF NOT EXISTS public.response_version_bookings",
+
+    # ---- Summary counters for /admin/metrics ----
+    # Sharded by backend pid so concurrent writers don't queue on one row;
+    # a counter's value is SUM(value) over its (at most 16) shards.
+    """
+    CREATE TABLE IF NOT EXISTS public.metric_counters (
+      name  TEXT     NOT NULL,
+      shard SMALLINT NOT NULL,
+      value BIGINT   NOT NULL DEFAULT 0,
+      PRIMARY KEY (name, shard)
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION public.bump_metric_counter(p_name TEXT, p_delta BIGINT)
+    RETURNS void LANGUAGE sql AS $$
+      INSERT INTO public.metric_counters (name, shard, value)
+      VALUES (p_name, mod(pg_backend_pid(), 16), p_delta)
+      ON CONFLICT (name, shard)
+      DO UPDATE SET value = public.metric_counters.value + EXCLUDED.value
+    $$
+    """,
+    # one-time backfill; must run before the triggers below exist
+    _COUNTERS_BACKFILL + "WHERE NOT EXISTS (SELECT 1 FROM public.metric_counters)",
+    # statement-level triggers: a multi-row INSERT bumps each counter once.
+    # Booking inserts are counted by the outbox worker instead (events.py),
+    # off the request's transaction; deletes/updates are rare and stay here.
+    """
+    CREATE OR REPLACE FUNCTION public.count_rows_metric() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM public.bump_metric_counter(TG_ARGV[0], (SELECT COUNT(*) FROM new_rows));
+      ELSE
+        PERFORM public.bump_metric_counter(TG_ARGV[0], -(SELECT COUNT(*) FROM old_rows));
+      END IF;
+      RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION public.booking_spending_metric() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.bump_metric_counter('spending', (SELECT COALESCE(SUM(coins_used), 0) FROM new_rows));
+      END IF;
+      IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM public.bump_metric_counter('spending', -(SELECT COALESCE(SUM(coins_used), 0) FROM old_rows));
+      END IF;
+      RETURN NULL;
+    END $$
+    """,
+    """
+    DO $$
+    DECLARE
+      t RECORD;
+    BEGIN
+      FOR t IN
+        SELECT * FROM (VALUES
+          ('users_count_ins',      'users',    'INSERT', 'NEW TABLE AS new_rows', 'count_rows_metric(''users'')'),
+          ('users_count_del',      'users',    'DELETE', 'OLD TABLE AS old_rows', 'count_rows_metric(''users'')'),
+          ('vehicles_count_ins',   'vehicles', 'INSERT', 'NEW TABLE AS new_rows', 'count_rows_metric(''vehicles'')'),
+          ('vehicles_count_del',   'vehicles', 'DELETE', 'OLD TABLE AS old_rows', 'count_rows_metric(''vehicles'')'),
+          ('bookings_count_del',   'bookings', 'DELETE', 'OLD TABLE AS old_rows', 'count_rows_metric(''rentals'')'),
+          ('bookings_spend_del',   'bookings', 'DELETE', 'OLD TABLE AS old_rows', 'booking_spending_metric()'),
+          ('bookings_spend_upd',   'bookings', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows', 'booking_spending_metric()')
+        ) AS x(name, tbl, op, refs, fn)
+      LOOP
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = t.name) THEN
+          EXECUTE format(
+            'CREATE TRIGGER %I AFTER %s ON public.%I REFERENCING %s FOR EACH STATEMENT EXECUTE FUNCTION public.%s',
+            t.name, t.op, t.tbl, t.refs, t.fn
+          );
+        END IF;
+      END LOOP;
+    END $$
+    """,
+    # (checked first: DROP TRIGGER locks the table even when there is none)
+    """
+    DO $$
+    BEGIN
+      IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'bookings_count_ins') THEN
+        DROP TRIGGER bookings_count_ins ON public.bookings;
+      END IF;
+      IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'bookings_spend_ins') THEN
+        DROP TRIGGER bookings_spend_ins ON public.bookings;
+      END IF;
+    END $$
+    """,
+
+    # ---- Vehicle search (/vehicles/search) ----
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # must match vehicles.SEARCH_DOC exactly for the planner to use it
+    """
+    CREATE INDEX IF NOT EXISTS vehicles_search_trgm
+    ON public.vehicles
+    USING gin (lower(type_of_car || ' ' || brand || ' ' || model) gin_trgm_ops)
+    """,
+
+    # ---- Coin ledger history / summaries (/coins/history, /coins/summary) ----
+    """
+    CREATE INDEX IF NOT EXISTS coin_transactions_user_time_idx
+    ON public.coin_transactions (username, created_at DESC, id DESC)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS public.coin_ledger_daily (
+      username TEXT   NOT NULL,
+      day      DATE   NOT NULL,
+      reason   TEXT   NOT NULL,
+      credits  BIGINT NOT NULL DEFAULT 0,
+      debits   BIGINT NOT NULL DEFAULT 0,
+      entries  BIGINT NOT NULL DEFAULT 0,
+      PRIMARY KEY (username, day, reason)
+    )
+    """,
+    # one-time backfill; later ledger rows arrive as CoinsChanged events
+    "INSERT INTO public.coin_ledger_daily (username, day, reason, credits, debits, entries)"
+    + _LEDGER_ROLLUP_SELECT.format(source="public.coin_transactions")
+    + "HAVING NOT EXISTS (SELECT 1 FROM public.coin_ledger_daily)",
+    # the rollup used to be a trigger on the request's INSERT
+    """
+    DO $$
+    BEGIN
+      IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'coin_ledger_rollup_ins') THEN
+        DROP TRIGGER coin_ledger_rollup_ins ON public.coin_transactions;
+      END IF;
+    END $$
+    """,
+    "DROP FUNCTION IF EXISTS public.coin_ledger_rollup()",
+]
+
+# recompute every counter from scratch (POST /admin/metrics/rebuild)
+REBUILD_METRIC_COUNTERS = [
+    "LOCK TABLE public.metric_counters IN EXCLUSIVE MODE",
+    "DELETE FROM public.metric_counters",
+    _COUNTERS_BACKFILL,
+]
+
+
+async def ensure_schema() -> None:
+    async with database.connection() as conn:
+        await conn.execute("SELECT pg_advisory_lock(:k)", {"k": SCHEMA_LOCK_KEY})
+        try:
+            for stmt in STATEMENTS:
+                try:
+                    await conn.execute(stmt)
+                except Exception:
+                    # e.g. missing privileges for CREATE EXTENSION: keep booting,
+                    # the queries still work, just without the index
+                    log.warning("schema statement failed: %s", " ".join(stmt.split()), exc_info=True)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(:k)", {"k": SCHEMA_LOCK_KEY})
@@ -0,0 +1,65 @@
+"""
+Production entry point: `python serve.py`.
+
+Runs uvicorn with several worker processes; each worker runs the app's
+lifespan warm-up (connect, schema, the pool's min_size connections,
+pricing table) and /ready turns 200 once it is
+done. Uses uvloop and httptools when they are installed.
+
+Settings (environment):
+
+    WORKERS / WEB_CONCURRENCY   worker processes (default: CPUs, at most 8)
+    HOST, PORT                  bind address (default 0.0.0.0:8000)
+    LOG_LEVEL                   uvicorn log level (default info)
+
+Session tokens must verify on every worker: without SESSION_SECRET a
+random one is generated here and handed to all workers (tokens then last
+until the next restart). Revocation is not shared: logout and password
+reset are remembered by the worker that handled them, so the token keeps
+verifying on the other workers until it expires. Keep SESSION_TTL short
+when that matters.
+
+Balances are not cached across several workers unless BALANCE_CACHE_BACKEND
+is set (redis); see balance_cache.py.
+
+Every worker has its own pool, so the database sees up to
+WORKERS x DB_POOL_MAX_SIZE connections; keep that below max_connections.
+"""
+import importlib.util
+import os
+import secrets
+
+import uvicorn
+
+
+def _workers() -> int:
+    value = os.environ.get("WORKERS") or os.environ.get("WEB_CONCURRENCY")
+    if value:
+        return max(1, int(value))
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def main() -> None:
+    # workers inherit the environment, so they all get the same key
+    os.environ.setdefault("SESSION_SECRET", secrets.token_hex(32))
+    workers = _workers()
+    if workers > 1:
+        # a per-worker balance cache would serve the old balance after a
+        # spend on another worker; cache only with a shared backend (redis)
+        os.environ.setdefault("BALANCE_CACHE_BACKEND", "none")
+    uvicorn.run(
+        "app:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", 8000)),
+        workers=workers,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        lifespan="on",
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        log_level=os.environ.get("LOG_LEVEL", "info"),
+    )
+
+
+if __name__ == "__main__":
+    main()
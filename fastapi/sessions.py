@@ -0,0 +1,139 @@
+"""
+Signed, expiring session tokens issued at login.
+
+A token is base64url(JSON claims) + "." + base64url(HMAC-SHA256 of that),
+keyed with SESSION_SECRET, so verifying one needs no database I/O:
+
+    {"sub": username, "iat": issued_at, "exp": expires_at, "jti": random id}
+
+Revocation is local to the worker: logout puts the token's jti in an LRU
+that only has to remember it until the token would expire anyway, and a
+password reset records a per-user cutoff that rejects every older token.
+Other workers (serve.py runs several) don't see either, so there a revoked
+token stays valid until it expires.
+
+Routes take the caller via a dependency:
+
+    async def get_balance(username: str, session_username: Optional[str] = Depends(session_user)):
+        authorize(session_username, username)
+
+With SESSION_REQUIRED=0 (the default, for clients that don't send the
+Authorization header yet) a request without a token is let through; a token
+for a different user is always rejected.
+
+    SESSION_SECRET     HMAC key; set it (same value on every worker) in production
+    SESSION_TTL        seconds a token stays valid (default 86400)
+    SESSION_REQUIRED   1 to reject unauthenticated calls (default 0)
+"""
+from typing import Optional
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 86_400))
+SESSION_REQUIRED = os.environ.get("SESSION_REQUIRED", "0") == "1"
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+if not SESSION_SECRET:
+    log.warning("SESSION_SECRET is not set; tokens are only valid on this worker until it restarts")
+    SESSION_SECRET = secrets.token_urlsafe(32)
+_KEY = SESSION_SECRET.encode()
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(_KEY, payload.encode(), hashlib.sha256).digest())
+
+
+class SessionStore:
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+        # token -> claims; skips base64/JSON/HMAC work for hot tokens
+        self._verified = TTLCache("sessions", maxsize=50_000, ttl=60)
+        # jti -> True, kept until the token's own expiry
+        self._revoked = TTLCache("revoked_sessions", maxsize=100_000, ttl=ttl)
+        # username -> tokens issued before this timestamp are invalid
+        self._cutoffs = TTLCache("session_cutoffs", maxsize=100_000, ttl=ttl)
+
+    def issue(self, username: str) -> dict:
+        now = round(time.time(), 3)
+        claims = {"sub": username, "iat": now, "exp": now + self.ttl, "jti": secrets.token_urlsafe(12)}
+        payload = _b64(json.dumps(claims, separators=(",", ":")).encode())
+        return {"token": f"{payload}.{_sign(payload)}", "expires_at": int(claims["exp"])}
+
+    def _decode(self, token: str) -> Optional[dict]:
+        payload, _, signature = token.partition(".")
+        if not signature or not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        try:
+            return json.loads(_unb64(payload))
+        except ValueError:
+            return None
+
+    def verify(self, token: str) -> Optional[str]:
+        """The token's username, or None if it is malformed, expired or revoked."""
+        claims = self._verified.get(token)
+        if claims is None:
+            claims = self._decode(token)
+            if claims is None:
+                return None
+            self._verified.set(token, claims, ttl=min(self._verified.ttl, max(claims["exp"] - time.time(), 0)))
+        if claims["exp"] <= time.time():
+            return None
+        if self._revoked.get(claims["jti"]):
+            return None
+        cutoff = self._cutoffs.get(claims["sub"])
+        if cutoff is not None and claims["iat"] < cutoff:
+            return None
+        return claims["sub"]
+
+    def revoke(self, token: str) -> None:
+        claims = self._decode(token)
+        if claims is not None:
+            self._revoked.set(claims["jti"], True, ttl=max(claims["exp"] - time.time(), 0))
+            self._verified.invalidate(token)
+
+    def revoke_user(self, username: str) -> None:
+        """Invalidate every token issued to `username` so far (password change)."""
+        self._cutoffs.set(username, time.time())
+
+
+sessions = SessionStore()
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def session_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Optional[str]:
+    """FastAPI dependency: the authenticated username, or None without a token."""
+    if credentials is None:
+        if SESSION_REQUIRED:
+            raise HTTPException(401, "Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        return None
+    username = sessions.verify(credentials.credentials)
+    if username is None:
+        raise HTTPException(401, "Invalid or expired session", headers={"WWW-Authenticate": "Bearer"})
+    return username
+
+
+def authorize(session_username: Optional[str], username: Optional[str]) -> None:
+    """403 unless the session (if any) belongs to `username`."""
+    if session_username is not None and session_username != username:
+        raise HTTPException(403, "Session does not belong to this user")
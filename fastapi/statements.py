@@ -0,0 +1,119 @@
+"""
+Prepared-statement registry for hot queries.
+
+Route modules register their hot SQL once at import time (positional $n
+parameters, no `databases` named-parameter rewriting):
+
+    USER_BALANCE = statements.register(
+        "coins.user_balance",
+        "SELECT username, coin_balance FROM public.users WHERE username = $1",
+    )
+    row = await statements.fetch_one(USER_BALANCE, username)
+
+Calls go straight to the task's raw asyncpg connection with the SQL as
+registered, so asyncpg's per-connection statement cache (pool.py,
+DB_STATEMENT_CACHE_SIZE) prepares each one on first use and reuses it
+after that; keep the cache larger than the number of registered
+statements. Only asyncpg's public API is used. Calls share the task's
+current `databases` connection, so they take part in
+`database.transaction()` blocks like any other query. Per-statement call
+counts and latency are reported by stats() (GET /admin/statements).
+"""
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+import asyncio
+import time
+
+from database import database
+from instrumentation import metrics
+
+
+class Statement:
+    __slots__ = ("name", "sql", "calls", "errors", "total", "max")
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.calls * 1000, 3) if self.calls else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "total_s": round(self.total, 3),
+        }
+
+
+class StatementRegistry:
+    def __init__(self, db):
+        self._db = db
+        self._statements: Dict[str, Statement] = {}
+
+    def register(self, name: str, sql: str) -> Statement:
+        if name in self._statements:
+            raise ValueError(f"statement {name!r} already registered")
+        stmt = self._statements[name] = Statement(name, sql)
+        return stmt
+
+    @asynccontextmanager
+    async def connection(self):
+        """The task's raw asyncpg connection (same one `database.transaction()` uses)."""
+        async with self._db.connection() as conn:
+            yield conn.raw_connection
+
+    async def prewarm(self, connections: int) -> int:
+        """
+        Check out `connections` pool connections at once (each task gets its
+        own), so the first requests don't pay for connecting. Returns the
+        number of connections checked out.
+        """
+        async def one() -> None:
+            async with self.connection() as raw:
+                await raw.execute("SELECT 1")
+
+        await asyncio.gather(*(asyncio.create_task(one()) for _ in range(connections)))
+        return connections
+
+    async def _run(self, method: str, stmt: Statement, args) -> Any:
+        async with self.connection() as raw:
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = await getattr(raw, method)(stmt.sql, *args)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                stmt.record(elapsed, ok)
+                metrics.observe_query(stmt.name, elapsed, ok)
+
+    async def fetch_all(self, stmt: Statement, *args) -> List[Any]:
+        return await self._run("fetch", stmt, args)
+
+    async def fetch_one(self, stmt: Statement, *args) -> Optional[Any]:
+        return await self._run("fetchrow", stmt, args)
+
+    async def fetch_val(self, stmt: Statement, *args) -> Any:
+        return await self._run("fetchval", stmt, args)
+
+    async def execute(self, stmt: Statement, *args) -> None:
+        await self._run("execute", stmt, args)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: s.as_dict() for name, s in sorted(self._statements.items())}
+
+
+statements = StatementRegistry(database)
@@ -0,0 +1,99 @@
+"""
+Concurrent overlapping bookings: exactly one may win.
+
+The automated counterpart of bench/booking_race.py. Requests go through the
+app in-process, but each one runs on its own pooled connection, so they
+really race in Postgres -- once guarded by the bookings_no_overlap
+exclusion constraint, once by advisory locks with the constraint dropped,
+and once by a single user checking their own bookings
+(allow_same_user_overlap), which the constraint doesn't cover.
+"""
+from collections import Counter
+from datetime import date, timedelta
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import requires_db
+
+CLIENTS = 20
+
+# OVERLAPPING_PAIRS without the different-users condition
+SAME_USER_OVERLAPS = """
+    SELECT COUNT(*)
+    FROM public.bookings a
+    JOIN public.bookings b
+      ON a.vehicle_id = b.vehicle_id
+     AND a.id < b.id
+     AND daterange(a.start_date, a.end_date, '[]') && daterange(b.start_date, b.end_date, '[]')
+    WHERE a.vehicle_id = :vehicle_id
+"""
+
+pytestmark = [requires_db, pytest.mark.anyio]
+
+
+@pytest.fixture
+async def api():
+    from app import app
+    from bench.booking_race import OVERLAPPING_PAIRS
+    from bench.fixtures import seed
+    from database import connect_db, database, disconnect_db
+    from schema import ensure_schema
+
+    await connect_db(retries=1)
+    try:
+        await seed(database, users=CLIENTS, vehicles=3, bookings=0)
+        await ensure_schema()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client, lambda: database.fetch_val(OVERLAPPING_PAIRS)
+    finally:
+        await disconnect_db()
+
+
+async def _race(client: httpx.AsyncClient, vehicle_id: int, same_user: bool = False) -> Counter:
+    start = date.today() + timedelta(days=30)
+
+    async def book(i: int) -> int:
+        r = await client.post("/bookings", json={
+            "vehicle_id": vehicle_id,
+            "username": "bench_user_0" if same_user else f"bench_user_{i}",
+            "start_date": start.isoformat(),
+            # every request overlaps every other by at least one day
+            "end_date": (start + timedelta(days=1 + i % 3)).isoformat(),
+            "allow_same_user_overlap": same_user,
+        })
+        return r.status_code
+
+    return Counter(await asyncio.gather(*(book(i) for i in range(CLIENTS))))
+
+
+async def test_exclusion_constraint_admits_one_booking(api):
+    client, overlapping_pairs = api
+    statuses = await _race(client, vehicle_id=1)
+    assert statuses == Counter({200: 1, 409: CLIENTS - 1})
+    assert await overlapping_pairs() == 0
+
+
+async def test_advisory_locks_admit_one_booking(api, monkeypatch):
+    from database import database
+    import routes.bookings
+
+    client, overlapping_pairs = api
+    # the CTE's own overlap check under the lock is all that guards this run
+    await database.execute("ALTER TABLE public.bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap")
+    monkeypatch.setattr(routes.bookings, "BOOKING_ADVISORY_LOCKS", True)
+    statuses = await _race(client, vehicle_id=2)
+    assert statuses == Counter({200: 1, 409: CLIENTS - 1})
+    assert await overlapping_pairs() == 0
+
+
+async def test_same_user_check_admits_one_booking(api):
+    from database import database
+
+    client, _ = api
+    # bookings_no_overlap ignores same-user pairs; the vehicle lock guards this run
+    statuses = await _race(client, vehicle_id=3, same_user=True)
+    assert statuses == Counter({200: 1, 409: CLIENTS - 1})
+    assert await database.fetch_val(SAME_USER_OVERLAPS, {"vehicle_id": 3}) == 0
@@ -17,6 +17,7 @@ import { useRouter } from "next/router";
 // dynamic base
 const host = typeof window !== "undefined" ? window.location.hostname : "localhost";
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || `http://${host}:8000`;
+const BOOKINGS_PAGE_SIZE = 20;
 
 export default function ProfilePage() {
   const router = useRouter();
@@ -24,6 +25,8 @@ export default function ProfilePage() {
 
   const [loading, setLoading] = useState(true);
   const [bookings, setBookings] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [description, setDescription] = useState("");
   const [saving, setSaving] = useState(false);
 
@@ -40,18 +43,29 @@ export default function ProfilePage() {
     })();
   }, [user?.username]);
 
-  // ---- fetch all bookings ----
+  // ---- fetch bookings, one page at a time (newest first) ----
+  const fetchBookingsPage = async (cursor) => {
+    const params = new URLSearchParams({ username: user.username, limit: String(BOOKINGS_PAGE_SIZE) });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`${API_BASE}/bookings/mine?${params}`);
+    const data = await res.json();
+    return {
+      rows: Array.isArray(data) ? data : [],
+      cursor: res.headers.get("X-Next-Cursor"),
+    };
+  };
+
   useEffect(() => {
     if (!user?.username) return;
     let cancelled = false;
     const load = async () => {
       setLoading(true);
       try {
-        const res = await fetch(
-          `${API_BASE}/bookings/mine?username=${encodeURIComponent(user.username)}`
-        );
-        const data = await res.json();
-        if (!cancelled) setBookings(Array.isArray(data) ? data : []);
+        const page = await fetchBookingsPage(null);
+        if (!cancelled) {
+          setBookings(page.rows);
+          setNextCursor(page.cursor);
+        }
       } catch (e) {
         console.error(e);
       } finally {
@@ -64,6 +78,20 @@ export default function ProfilePage() {
     };
   }, [user?.username]);
 
+  const loadMoreBookings = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await fetchBookingsPage(nextCursor);
+      setBookings((prev) => [...prev, ...page.rows]);
+      setNextCursor(page.cursor);
+    } catch (e) {
+      console.error(e);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // ---- save description ----
   const saveDescription = async () => {
     if (!user?.username) return;
@@ -279,6 +307,16 @@ export default function ProfilePage() {
             {bookings.map((b) => (
               <RentalCard key={b.id} booking={b} />
             ))}
+            {nextCursor && (
+              <Button
+                variant="outlined"
+                onClick={loadMoreBookings}
+                disabled={loadingMore}
+                sx={{ fontWeight: 800, justifySelf: "center", borderColor: "#ff9702", color: "#000" }}
+              >
+                {loadingMore ? "LOADING..." : "LOAD MORE"}
+              </Button>
+            )}
           </Box>
         )}
       </Card>